@@ -1,7 +1,11 @@
 import os.path
 import base64
+import threading
+from multiprocessing.pool import ThreadPool
+from greendizer import http
 from greendizer.resources.buyers import Buyer
 from greendizer.resources.sellers import Seller
+from greendizer.dal import IdentityMap
 
 
 
@@ -24,8 +28,32 @@ class Client(object):
         @param email:str Email
         @param password:str Password
         @param access_token:str OAuth access token
+        The cache attribute can be set to a greendizer.cache.ResponseCache
+        to store GET responses and revalidate them with their Etag.
+        The identity_map attribute ensures each resource obtained from a node
+        is represented by a single instance (set it to None to disable it).
+        The compression attribute holds the greendizer.http.CompressionPolicy
+        applied to XML bodies (set it to None to send them uncompressed).
+        The retry attribute holds the greendizer.http.RetryPolicy applied to
+        idempotent requests (set it to None to disable retries).
+        The limiter attribute can be set to a greendizer.http.RateLimiter to
+        bound the rate and the concurrency of the requests of the client.
+        The transport attribute holds the greendizer.http.Transport through
+        which requests are sent, the shared connection pool by default.
+        The hooks attribute is a list of functions called with the
+        greendizer.instrumentation.Span measured for each request, such as
+        a greendizer.instrumentation.HistogramAggregator.
         '''
         self.__authorization_header = None
+        self.__executor = None
+        self.__executor_lock = threading.Lock()
+        self.cache = None
+        self.identity_map = IdentityMap()
+        self.compression = http.CompressionPolicy()
+        self.retry = http.RetryPolicy()
+        self.limiter = None
+        self.transport = http.CONNECTION_POOL
+        self.hooks = []
         self._user = user
         self._email = email
         self._password = password
@@ -42,6 +70,38 @@ class Client(object):
         return self._email
 
 
+    @property
+    def executor(self):
+        '''
+        Gets the thread pool on which the asynchronous operations are run.
+        Its size is set by greendizer.http.EXECUTOR_SIZE.
+        @return: ThreadPool
+        '''
+        self.__executor_lock.acquire()
+        try:
+            if not self.__executor:
+                self.__executor = ThreadPool(http.EXECUTOR_SIZE)
+
+            return self.__executor
+        finally:
+            self.__executor_lock.release()
+
+
+    def close(self):
+        '''
+        Waits for the pending asynchronous operations and stops the executor.
+        '''
+        self.__executor_lock.acquire()
+        try:
+            executor, self.__executor = self.__executor, None
+        finally:
+            self.__executor_lock.release()
+
+        if executor:
+            executor.close()
+            executor.join()
+
+
     @property
     def user(self):
         '''
@@ -0,0 +1,455 @@
+import os
+import time
+import shutil
+import random
+import hashlib
+import threading
+import cPickle as pickle
+from collections import OrderedDict
+
+
+
+
+class CacheEntry(object):
+    '''
+    Represents a response stored in a cache.
+    '''
+    def __init__(self, data, etag, headers, stored=None):
+        '''
+        Initializes a new instance of the CacheEntry class.
+        @param data:str Body of the response, as received
+        @param etag:str Raw value of the Etag header
+        @param headers:list List of (name, value) tuples
+        @param stored:float Time at which the response was received
+        '''
+        self.data = data
+        self.etag = etag
+        self.headers = headers
+        self.stored = stored or time.time()
+
+
+
+
+class ResponseCache(object):
+    '''
+    Represents a cache of API responses keyed by credentials, URI and range.
+    Entries are served without contacting the server for ttl seconds, then
+    revalidated with an If-None-Match request.
+    The keys of a path also contain a generation token, stored in the cache
+    itself, which is renewed to invalidate all the entries of the path at
+    once.
+    '''
+    def __init__(self, ttl=0):
+        '''
+        Initializes a new instance of the ResponseCache class.
+        @param ttl:int Number of seconds during which an entry is served
+        without revalidation.
+        '''
+        self.ttl = ttl
+
+
+    def is_fresh(self, entry):
+        '''
+        Gets a value indicating whether an entry can be served without
+        revalidation.
+        @param entry:CacheEntry
+        @return: bool
+        '''
+        return time.time() - entry.stored < self.ttl
+
+
+    def get_key(self, uri, authorization=None, range=None):
+        '''
+        Gets the key of the response to a GET request.
+        @param uri:str URI of the resource
+        @param authorization:str Authorization header, as responses differ
+        from one account to another.
+        @param range:str Range header
+        @return: str
+        '''
+        return "|".join([hashlib.sha1(authorization or "").hexdigest(),
+                         self.__get_generation(uri.split("?")[0]), uri,
+                         range or ""])
+
+
+    def invalidate(self, uri):
+        '''
+        Invalidates the entries of a resource, whatever their query string
+        and range, along with those of the collection containing it.
+        @param uri:str URI of the resource
+        '''
+        path = uri.split("?")[0]
+        parent = path.rstrip("/").rsplit("/", 1)[0] + "/"
+        for key in set([path, parent]):
+            previous = self.get("generation|" + key)
+            self.__set_generation(key)
+            if previous is not None:
+                self._drop_generation(previous.data)
+
+
+    def _drop_generation(self, generation):
+        '''
+        Called once a generation token has been renewed, as the entries
+        stored under it will never be read again.
+        @param generation:str Generation token
+        '''
+        pass
+
+
+    def __get_generation(self, path):
+        '''
+        Gets the generation token of a path, creating it if necessary.
+        @param path:str Path
+        @return: str
+        '''
+        entry = self.get("generation|" + path)
+        if entry is None:
+            entry = self.__set_generation(path)
+
+        return entry.data
+
+
+    def __set_generation(self, path):
+        '''
+        Renews the generation token of a path. A random token is used, so
+        that an evicted token never brings back stale entries.
+        @param path:str Path
+        @return: CacheEntry
+        '''
+        entry = CacheEntry("%016x" % random.getrandbits(64), None, [])
+        self.set("generation|" + path, entry)
+        return entry
+
+
+    def get(self, key):
+        '''
+        Gets an entry.
+        @param key:str Key
+        @return: CacheEntry
+        '''
+        raise NotImplementedError()
+
+
+    def set(self, key, entry):
+        '''
+        Stores an entry.
+        @param key:str Key
+        @param entry:CacheEntry
+        '''
+        raise NotImplementedError()
+
+
+    def delete(self, key):
+        '''
+        Removes an entry.
+        @param key:str Key
+        '''
+        raise NotImplementedError()
+
+
+    def clear(self):
+        '''
+        Removes all the entries.
+        '''
+        raise NotImplementedError()
+
+
+
+
+class MemoryCache(ResponseCache):
+    '''
+    Represents an in-memory cache evicting the least recently used entries.
+    '''
+    def __init__(self, size=1000, ttl=0):
+        '''
+        Initializes a new instance of the MemoryCache class.
+        @param size:int Maximum number of entries
+        @param ttl:int Number of seconds during which an entry is served
+        without revalidation.
+        '''
+        super(MemoryCache, self).__init__(ttl)
+        self.size = size
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+
+    def __len__(self):
+        '''
+        Returns the number of entries.
+        @return: int
+        '''
+        return len(self.__entries)
+
+
+    def get(self, key):
+        '''
+        Gets an entry and marks it as recently used.
+        @param key:str Key
+        @return: CacheEntry
+        '''
+        self.__lock.acquire()
+        try:
+            entry = self.__entries.pop(key, None)
+            if entry:
+                self.__entries[key] = entry
+
+            return entry
+        finally:
+            self.__lock.release()
+
+
+    def set(self, key, entry):
+        '''
+        Stores an entry, evicting the least recently used one if the cache
+        is full.
+        @param key:str Key
+        @param entry:CacheEntry
+        '''
+        self.__lock.acquire()
+        try:
+            self.__entries.pop(key, None)
+            self.__entries[key] = entry
+            while len(self.__entries) > self.size:
+                self.__entries.popitem(last=False)
+        finally:
+            self.__lock.release()
+
+
+    def delete(self, key):
+        '''
+        Removes an entry.
+        @param key:str Key
+        '''
+        self.__lock.acquire()
+        try:
+            self.__entries.pop(key, None)
+        finally:
+            self.__lock.release()
+
+
+    def clear(self):
+        '''
+        Removes all the entries.
+        '''
+        self.__lock.acquire()
+        try:
+            self.__entries.clear()
+        finally:
+            self.__lock.release()
+
+
+
+
+class FileCache(ResponseCache):
+    '''
+    Represents a cache storing one file per entry in a directory.
+    The entries of each generation token are stored in a subdirectory, which
+    is removed when the token is renewed. Once the cache is full, the least
+    recently used files are evicted.
+    '''
+    def __init__(self, directory, ttl=0, size=10000):
+        '''
+        Initializes a new instance of the FileCache class.
+        @param directory:str Path of the directory
+        @param ttl:int Number of seconds during which an entry is served
+        without revalidation.
+        @param size:int Maximum number of entries
+        '''
+        super(FileCache, self).__init__(ttl)
+        self.directory = directory
+        self.size = size
+        self.__count = None
+        self.__lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+
+    def __path(self, key):
+        '''
+        Gets the path of the file storing an entry.
+        @param key:str Key
+        @return: str
+        '''
+        parts = key.split("|")
+        directory = self.directory
+        if parts[0] != "generation":
+            directory = os.path.join(directory, parts[1])
+
+        return os.path.join(directory, hashlib.sha1(key).hexdigest())
+
+
+    def get(self, key):
+        '''
+        Gets an entry from its file, and marks it as recently used.
+        @param key:str Key
+        @return: CacheEntry
+        '''
+        path = self.__path(key)
+        try:
+            f = open(path, "rb")
+            try:
+                entry = pickle.load(f)
+            finally:
+                f.close()
+
+            os.utime(path, None)
+            return entry
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+
+    def set(self, key, entry):
+        '''
+        Writes an entry to its file, evicting the least recently used ones
+        if the cache is full.
+        @param key:str Key
+        @param entry:CacheEntry
+        '''
+        path = self.__path(key)
+        if not os.path.isdir(os.path.dirname(path)):
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError:
+                pass #Created by another thread
+
+        temp = "%s.%s.%s" % (path, os.getpid(), threading.current_thread().ident)
+        f = open(temp, "wb")
+        try:
+            pickle.dump(entry, f, pickle.HIGHEST_PROTOCOL)
+        finally:
+            f.close()
+
+        added = not os.path.exists(path)
+        os.rename(temp, path)
+        if added:
+            self.__lock.acquire()
+            try:
+                if self.__count is None:
+                    self.__count = len(self.__list_files())
+                else:
+                    self.__count += 1
+
+                if self.__count > self.size:
+                    self.__sweep()
+            finally:
+                self.__lock.release()
+
+
+    def delete(self, key):
+        '''
+        Removes the file of an entry.
+        @param key:str Key
+        '''
+        try:
+            os.remove(self.__path(key))
+            self.__adjust_count(-1)
+        except OSError:
+            pass
+
+
+    def clear(self):
+        '''
+        Removes the files of all the entries.
+        '''
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+            except OSError:
+                pass
+
+        self.__adjust_count(None)
+
+
+    def _drop_generation(self, generation):
+        '''
+        Removes the subdirectory storing the entries of a generation token.
+        @param generation:str Generation token
+        '''
+        directory = os.path.join(self.directory, generation)
+        if os.path.isdir(directory):
+            count = len(os.listdir(directory))
+            shutil.rmtree(directory, True)
+            self.__adjust_count(-count)
+
+
+    def __adjust_count(self, delta):
+        '''
+        Updates the number of entries, or forgets it so that it is counted
+        again on the next write.
+        @param delta:int Number of entries added, or None.
+        '''
+        self.__lock.acquire()
+        try:
+            if self.__count is not None and delta is not None:
+                self.__count += delta
+            else:
+                self.__count = None
+        finally:
+            self.__lock.release()
+
+
+    def __list_files(self):
+        '''
+        Lists the files of the entries, generation tokens included. The
+        temporary files being written are left out.
+        @return: list of (directory, name) tuples
+        '''
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if os.path.isdir(path):
+                files.extend([ (path, entry) for entry in os.listdir(path)
+                               if "." not in entry ])
+            elif "." not in name:
+                files.append((self.directory, name))
+
+        return files
+
+
+    def __sweep(self):
+        '''
+        Evicts the least recently used files until a tenth of the cache is
+        free, then removes the subdirectories of the generation tokens which
+        are no longer in the cache.
+        '''
+        files = []
+        for directory, name in self.__list_files():
+            path = os.path.join(directory, name)
+            try:
+                files.append((os.path.getmtime(path), path))
+            except OSError:
+                pass
+
+        files.sort()
+        target = self.size - self.size // 10
+        for modified, path in files[:max(0, len(files) - target)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+        generations = set()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if os.path.isdir(path) or "." in name:
+                continue
+
+            try:
+                f = open(path, "rb")
+                try:
+                    generations.add(pickle.load(f).data)
+                finally:
+                    f.close()
+            except (IOError, EOFError, pickle.UnpicklingError):
+                pass
+
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if os.path.isdir(path) and name not in generations:
+                shutil.rmtree(path, True)
+
+        self.__count = len(self.__list_files())
@@ -1,6 +1,12 @@
 import urllib
+import threading
+from weakref import WeakValueDictionary
+from collections import deque
+from itertools import islice
+from multiprocessing.pool import ThreadPool
 from datetime import datetime, date
-from greendizer.http import Request, Etag, Range, ApiException
+from greendizer.http import (Request, Etag, Range, ContentRange, ApiException,
+                             submit, POOL_SIZE)
 from greendizer.base import (is_empty_or_none, timestamp_to_datetime,
                              datetime_to_timestamp)
 
@@ -8,6 +14,7 @@ from greendizer.base import (is_empty_or_none, timestamp_to_datetime,
 
 
 RESPONSE_SIZE_LIMIT = 200
+SYNC_SCAN_INTERVAL = 10
 
 
 
@@ -80,6 +87,7 @@ class Resource(object):
         self.__raw_data = {}
         self.__raw_updates = {}
         self.__deleted = False
+        self.__partial = False
 
 
     def _get_date_attribute(self, name):
@@ -103,7 +111,8 @@ class Resource(object):
         if self.__deleted:
             raise ResourceDeletedException()
 
-        if not len(self.__raw_data): # What a lazy ass...
+        if (not len(self.__raw_data) # What a lazy ass...
+            or (self.__partial and name not in self.__raw_data)):
             self.load()
 
         return self.__raw_data.get(name, None)
@@ -140,6 +149,17 @@ class Resource(object):
 
         if self.__raw_data.get(attribute, None) != value:
             self.__raw_updates[attribute] = value
+            self.__track_updates()
+
+
+    def __track_updates(self):
+        '''
+        Lets the identity map of the client know whether the resource has
+        pending updates, so that it is kept alive until they are sent.
+        '''
+        identity_map = getattr(self.__client, "identity_map", None)
+        if identity_map is not None:
+            identity_map.set_dirty(self, len(self.__raw_updates) > 0)
 
 
     @property
@@ -184,6 +204,26 @@ class Resource(object):
         return self.__deleted
 
 
+    @property
+    def pending_updates(self):
+        '''
+        Gets the updates registered and not sent to the server yet.
+        @return: dict
+        '''
+        return dict(self.__raw_updates)
+
+
+    @property
+    def is_loaded(self):
+        '''
+        Gets a value indicating whether the full representation of this
+        resource has been retrieved from the server, rather than some of its
+        fields only.
+        @return: bool
+        '''
+        return len(self.__raw_data) > 0 and not self.__partial
+
+
     @property
     def client(self):
         '''
@@ -220,12 +260,22 @@ class Resource(object):
         raise NotImplementedError()
 
 
-    def sync(self, data, etag):
+    def sync(self, data, etag, partial=False):
         '''
         Updates the current representation with another one.
         @param data:dict New representation
+        @param partial:bool A value indicating whether the representation
+        only contains some of the fields. The missing fields are loaded
+        when they are read.
         @return: bool A value indicating whether the representation has changed.
         '''
+        if not partial:
+            self.__partial = False
+        elif (not len(self.__raw_data)
+              or etag.last_modified != self.__last_modified):
+            #The fields already known may be out of date.
+            self.__partial = True
+
         self.__last_modified = etag.last_modified
         self.__id = etag.id
 
@@ -258,13 +308,50 @@ class Resource(object):
         request = Request(self.__client, uri=self.uri,
                           method=("HEAD" if head else "GET"))
 
-        if len(self.__raw_data):
+        if len(self.__raw_data) and not self.__partial:
             request["If-Match"] = self.etag
             request["If-Unmodified-Since"] = self.etag.last_modified
 
         response = request.get_response()
         if response.status_code == 200:
-            self.sync({} if head else response.data, response["Etag"])
+            self.sync({} if head else response.data, response["Etag"], head)
+
+
+    def load_async(self, head=False, callback=None):
+        '''
+        Loads the resource without blocking.
+        @param head:bool A value indicating whether to use the HEAD HTTP
+        method.
+        @param callback:function Function called once the resource is loaded.
+        @return: AsyncResult
+        '''
+        return submit(self.__client, self.load, (head,), callback)
+
+
+    def update_async(self, prevent_conflicts=False, callback=None):
+        '''
+        Updates the resource without blocking.
+        @param prevent_conflicts:bool A value indicating whether the resource
+        should not be updated if the current version is not the most recent
+        one available.
+        @param callback:function Function called once the resource is updated.
+        @return: AsyncResult
+        '''
+        return submit(self.__client, self.update, (prevent_conflicts,),
+                      callback)
+
+
+    def delete_async(self, prevent_conflicts=False, callback=None):
+        '''
+        Deletes the resource without blocking.
+        @param prevent_conflicts:bool A value indicating whether the resource
+        should not be deleted if the current version is not the most recent
+        one available.
+        @param callback:function Function called once the resource is deleted.
+        @return: AsyncResult
+        '''
+        return submit(self.__client, self.delete, (prevent_conflicts,),
+                      callback)
 
 
     def update(self, prevent_conflicts=False):
@@ -294,6 +381,7 @@ class Resource(object):
         if response.status_code == 204: #No-Content
             self.sync(self.__raw_updates, response["Etag"])
             self.__raw_updates = {}
+            self.__track_updates()
 
 
     def delete(self, prevent_conflicts=False):
@@ -320,6 +408,141 @@ class Resource(object):
             self.__deleted = True
             self.__raw_data = {}
             self.__raw_updates = {}
+            self.__track_updates()
+
+
+
+
+class BatchResult(object):
+    '''
+    Represents the outcome of an operation applied to a list of resources.
+    '''
+    def __init__(self):
+        '''
+        Initializes a new instance of the BatchResult class.
+        '''
+        self.__outcomes = []
+
+
+    def __iter__(self):
+        '''
+        Iterates over the (resource, exception) tuples, in the order of the
+        resources. The exception is None when the operation succeeded.
+        '''
+        return iter(self.__outcomes)
+
+
+    def __len__(self):
+        '''
+        Returns the number of resources processed.
+        @return: int
+        '''
+        return len(self.__outcomes)
+
+
+    def add(self, resource, exception=None):
+        '''
+        Records the outcome of the operation for a resource.
+        @param resource:Resource
+        @param exception:Exception Exception raised, if any.
+        '''
+        self.__outcomes.append((resource, exception))
+
+
+    @property
+    def succeeded(self):
+        '''
+        Gets the resources for which the operation succeeded.
+        @return: list
+        '''
+        return [ resource for resource, error in self.__outcomes if not error ]
+
+
+    @property
+    def failed(self):
+        '''
+        Gets the resources for which the operation failed, with the
+        exception raised.
+        @return: list of tuples
+        '''
+        return [ (resource, error) for resource, error in self.__outcomes
+                 if error ]
+
+
+    @property
+    def conflicts(self):
+        '''
+        Gets the conflicts which prevented the operation.
+        @return: list of ResourceConflictException
+        '''
+        return [ error for resource, error in self.__outcomes
+                 if isinstance(error, ResourceConflictException) ]
+
+
+    @property
+    def ok(self):
+        '''
+        Gets a value indicating whether the operation succeeded for all the
+        resources.
+        @return: bool
+        '''
+        return not len(self.failed)
+
+
+
+
+def run_batch(operation, resources, concurrency=POOL_SIZE, result=None):
+    '''
+    Applies an operation to a list of resources on a thread pool, recording
+    the outcome for each of them instead of stopping at the first failure.
+    @param operation:function Function called with a resource
+    @param resources:list Resources
+    @param concurrency:int Maximum number of concurrent operations
+    @param result:BatchResult Result to record the outcomes into, if any.
+    @return: BatchResult
+    '''
+    def apply(resource):
+        try:
+            operation(resource)
+            return resource, None
+        except Exception, e:
+            return resource, e
+
+    result = result if result is not None else BatchResult()
+    if not resources:
+        return result
+
+    pool = ThreadPool(max(1, min(concurrency, len(resources))))
+    try:
+        for resource, error in pool.imap(apply, resources):
+            result.add(resource, error)
+    finally:
+        pool.terminate()
+
+    return result
+
+
+
+
+class ChangeSet(object):
+    '''
+    Represents the changes found in a collection since its last sync.
+    '''
+    def __init__(self):
+        '''
+        Initializes a new instance of the ChangeSet class.
+        '''
+        self.added = []
+        self.changed = []
+        self.removed = []
+
+
+    def __len__(self):
+        '''
+        Returns the number of changes.
+        @return: int
+        '''
+        return len(self.added) + len(self.changed) + len(self.removed)
 
 
 
@@ -342,6 +565,8 @@ class Collection(object):
         self.__etag = Etag(datetime(1970, 1, 1), 0)
         self.__resources = {}
         self.__list = []
+        self.__synced = None
+        self.__syncs = 0
 
 
     def __iter__(self):
@@ -430,6 +655,384 @@ class Collection(object):
         @param offset:int Offset
         @param limit:int Limit (Max: 200)
         '''
+        response = self.__get_page(offset, limit, head, fields)
+
+        if response.status_code in [204, 416]: #(No-Content, Out-Range)
+            self.__resources = {}
+            self.__list = []
+            return
+
+        if response.status_code not in [200, 206]: #(OK, Partial Content)
+            return Exception("Unexpected response from the server (code: %s)"
+                             % response.status_code)
+
+        if not head:
+            self.__load_pages([self.__read_page(response,
+                                                not is_empty_or_none(fields))])
+
+
+    def populate_async(self, offset=0, limit=200, head=False, fields=None,
+                       callback=None):
+        '''
+        Populates the collection without blocking.
+        @param offset:int Offset
+        @param limit:int Limit (Max: 200)
+        @param callback:function Function called once the collection is
+        populated.
+        @return: AsyncResult
+        '''
+        return submit(self.__node.client, self.populate,
+                      (offset, limit, head, fields), callback)
+
+
+    def iterate(self, page_size=RESPONSE_SIZE_LIMIT, pages=1, fields=None,
+                prefetch=0):
+        '''
+        Iterates over all the resources available on the server, fetching
+        the pages on demand.
+        Only the last pages fetched are kept in the collection.
+        @param page_size:int Number of resources per page (Max: 200)
+        @param pages:int Maximum number of pages to keep in memory.
+        @param fields:str Fields to retrieve
+        @param prefetch:int Number of pages to fetch concurrently ahead of
+        the iteration.
+        @return: generator
+        '''
+        page_size = min(RESPONSE_SIZE_LIMIT, page_size)
+        if prefetch > 0:
+            fetched = self.__prefetch_pages(page_size, fields, prefetch)
+        else:
+            fetched = self.__fetch_pages(page_size, fields)
+
+        window = deque(maxlen=max(1, pages))
+        for page in fetched:
+            window.append(page)
+            self.__load_pages(window)
+            for resource in page:
+                yield resource
+
+
+    def iterate_async(self, callback, page_size=RESPONSE_SIZE_LIMIT, pages=1,
+                      fields=None, prefetch=0):
+        '''
+        Iterates over all the resources available on the server without
+        blocking. The iteration runs on the executor of the client.
+        @param callback:function Function called with each resource, on the
+        executor. An exception raised by the callback stops the iteration.
+        @param page_size:int Number of resources per page (Max: 200)
+        @param pages:int Maximum number of pages to keep in memory.
+        @param fields:str Fields to retrieve
+        @param prefetch:int Number of pages to fetch concurrently ahead of
+        the iteration.
+        @return: AsyncResult Result giving the number of resources.
+        '''
+        def run():
+            count = 0
+            for resource in self.iterate(page_size, pages, fields, prefetch):
+                callback(resource)
+                count += 1
+
+            return count
+
+        return submit(self.__node.client, run)
+
+
+    def sync(self, fields=None):
+        '''
+        Brings the collection up to date with the server. The first call
+        loads all the resources; the following ones only retrieve the
+        resources modified since the previous sync, and merge them into the
+        collection.
+        Removed resources are found by listing the IDs of the collection
+        whenever its total differs from the number of resources synced, and
+        every SYNC_SCAN_INTERVAL syncs, as additions the delta did not return
+        can hide removals from the total.
+        @param fields:str Fields to retrieve
+        @return: ChangeSet IDs of the resources added, changed and removed.
+        '''
+        changes = ChangeSet()
+        source = self
+        if self.__synced is not None:
+            if self.__etag:
+                content_range, etag = self.__content_range, self.__etag
+                response = self.__get_page(None, None, head=True)
+                if response.status_code == 304: #Not Modified
+                    self.__content_range, self.__etag = content_range, etag
+                    return changes
+
+            since = max([0L] + [ Etag.parse(etag).timestamp
+                                 for etag in self.__synced.values() ])
+            query = "lastModified>>%d" % (since - 1)
+            source = Collection(self.__node, self.__node._uri,
+                                self.__query + "|" + query if self.__query
+                                else query)
+        else:
+            self.__synced = {}
+            self.__resources = {}
+            self.__list = []
+
+        for page in source.__fetch_pages(RESPONSE_SIZE_LIMIT, fields):
+            for resource in page:
+                identifier = str(resource.id)
+                previous = self.__synced.get(identifier, None)
+                current = self.__resources.get(identifier, None)
+                if current is None:
+                    self.__list.append(resource)
+                elif current is not resource:
+                    self.__list[self.__list.index(current)] = resource
+
+                self.__resources[identifier] = resource
+                if previous is None:
+                    changes.added.append(identifier)
+                elif previous != str(resource.etag):
+                    changes.changed.append(identifier)
+
+                self.__synced[identifier] = str(resource.etag)
+
+        if source is not self:
+            self.__syncs += 1
+            self.__get_page(0, 1, head=True)
+            total = self.__content_range.total if self.__content_range else 0
+            if (total != len(self.__synced)
+                or self.__syncs % SYNC_SCAN_INTERVAL == 0):
+                #Some resources were removed or no longer match the query.
+                found = set([ str(resource.id) for page in
+                              self.__fetch_pages(RESPONSE_SIZE_LIMIT, "id")
+                              for resource in page ])
+                changes.removed = [ identifier for identifier in self.__synced
+                                    if identifier not in found ]
+                self.__remove([ self.__resources[identifier]
+                                for identifier in changes.removed
+                                if identifier in self.__resources ], False)
+                for identifier in changes.removed:
+                    del self.__synced[identifier]
+
+        return changes
+
+
+    def delete_all(self, prevent_conflicts=False, concurrency=POOL_SIZE):
+        '''
+        Deletes all the resources of the collection. The resources are
+        deleted concurrently, one page at a time.
+        @param prevent_conflicts:bool A value indicating whether resources
+        should not be deleted if their current version is not the most
+        recent one available.
+        @param concurrency:int Maximum number of concurrent requests
+        @return: BatchResult
+        '''
+        return self.__apply_all(
+            lambda resource: resource.delete(prevent_conflicts), concurrency)
+
+
+    def set_all(self, prevent_conflicts=False, concurrency=POOL_SIZE,
+                **attributes):
+        '''
+        Sets attributes on all the resources of the collection, such as
+        location=2 or read=True. The resources are updated concurrently, one
+        page at a time.
+        @param prevent_conflicts:bool A value indicating whether resources
+        should not be updated if their current version is not the most
+        recent one available.
+        @param concurrency:int Maximum number of concurrent requests
+        @return: BatchResult
+        '''
+        for name in attributes:
+            attribute = getattr(self.__node._resource_cls, name, None)
+            if not isinstance(attribute, property) or not attribute.fset:
+                raise AttributeError("'%s' cannot be set." % name)
+
+        def apply(resource):
+            for name, value in attributes.items():
+                setattr(resource, name, value)
+
+            resource.update(prevent_conflicts)
+
+        return self.__apply_all(apply, concurrency)
+
+
+    def __apply_all(self, operation, concurrency):
+        '''
+        Applies an operation to all the resources of the collection, one page
+        at a time. Resources which leave the collection as a result (deleted,
+        or no longer matching the query) shift the following ones, so the
+        offset of the next page is corrected by the change of the total.
+        @param operation:function Function called with a resource
+        @param concurrency:int Maximum number of concurrent requests
+        @return: BatchResult
+        '''
+        result = BatchResult()
+        offset = 0
+        while True:
+            page, content_range, etag = self.__fetch_page(offset,
+                                                          RESPONSE_SIZE_LIMIT)
+            self.__content_range, self.__etag = content_range, etag
+            self.__load_pages([page])
+            if not len(page):
+                break
+
+            run_batch(operation, page, concurrency, result)
+            self.__remove([ resource for resource in page
+                            if resource.is_deleted ])
+            offset += len(page)
+            if content_range:
+                self.load_info()
+                if not self.__content_range: #No resources left
+                    self.__content_range = ContentRange(content_range.unit,
+                                                        0, 0, 0)
+                    self.__load_pages([])
+                    break
+
+                offset -= max(0, content_range.total -
+                                 self.__content_range.total)
+
+            if len(page) < RESPONSE_SIZE_LIMIT:
+                break
+
+        return result
+
+
+    def __remove(self, resources, adjust_total=True):
+        '''
+        Removes resources from the collection, without reloading it.
+        @param resources:list Resources to remove
+        @param adjust_total:bool A value indicating whether to deduct the
+        resources from the total number of resources available.
+        '''
+        if not len(resources):
+            return
+
+        removed = set([ str(resource.id) for resource in resources ])
+        self.__list = [ resource for resource in self.__list
+                        if str(resource.id) not in removed ]
+        for identifier in removed:
+            self.__resources.pop(identifier, None)
+
+        if self.__content_range and adjust_total:
+            self.__content_range = ContentRange(
+                self.__content_range.unit, 0, max(0, len(self.__list) - 1),
+                max(0, self.__content_range.total - len(removed)))
+
+
+    def __fetch_pages(self, page_size, fields=None, offset=0):
+        '''
+        Fetches the pages of the collection one after another.
+        @param page_size:int Number of resources per page
+        @param fields:str Fields to retrieve
+        @param offset:int Offset of the first page
+        @return: generator
+        '''
+        while True:
+            page, content_range, etag = self.__fetch_page(offset, page_size,
+                                                          fields)
+            self.__content_range, self.__etag = content_range, etag
+            if not len(page):
+                break
+
+            yield page
+
+            offset += len(page)
+            if content_range:
+                if offset >= content_range.total:
+                    break
+            elif len(page) < page_size:
+                break
+
+
+    def __prefetch_pages(self, page_size, fields, depth):
+        '''
+        Fetches the pages of the collection on a thread pool, keeping a
+        number of requests in flight ahead of the consumer.
+        Pages are yielded in order.
+        @param page_size:int Number of resources per page
+        @param fields:str Fields to retrieve
+        @param depth:int Number of pages to fetch concurrently
+        @return: generator
+        '''
+        self.load_info()
+        if not self.__content_range:
+            for page in self.__fetch_pages(page_size, fields):
+                yield page
+
+            return
+
+        total = latest = self.__content_range.total
+        offsets = iter(xrange(0, total, page_size))
+        pool = ThreadPool(depth)
+        try:
+            pending = deque([ pool.apply_async(self.__fetch_page,
+                                               (offset, page_size, fields))
+                              for offset in islice(offsets, depth) ])
+            while len(pending):
+                page, content_range, etag = pending.popleft().get()
+                self.__content_range, self.__etag = content_range, etag
+                if content_range:
+                    latest = content_range.total
+
+                for offset in islice(offsets, 1):
+                    pending.append(pool.apply_async(self.__fetch_page,
+                                                    (offset, page_size,
+                                                     fields)))
+                if len(page):
+                    yield page
+        finally:
+            pool.terminate()
+
+        if latest > total:
+            #Resources were added while iterating.
+            for page in self.__fetch_pages(page_size, fields, offset=total):
+                yield page
+
+
+    def __fetch_page(self, offset, limit, fields=None):
+        '''
+        Fetches a range of resources. The headers of the response are
+        returned instead of being recorded, as pages can be fetched
+        concurrently.
+        @param offset:int Offset
+        @param limit:int Limit (Max: 200)
+        @param fields:str Fields to retrieve
+        @return: tuple (list, ContentRange, Etag)
+        '''
+        response = self.__send_page_request(offset, limit, fields=fields)
+        content_range, etag = response["Content-Range"], response["Etag"]
+        if response.status_code in [204, 416]: #(No-Content, Out-Range)
+            return [], content_range, etag
+
+        if response.status_code not in [200, 206]: #(OK, Partial Content)
+            raise Exception("Unexpected response from the server (code: %s)"
+                            % response.status_code)
+
+        return (self.__read_page(response, not is_empty_or_none(fields)),
+                content_range, etag)
+
+
+    def __get_page(self, offset, limit, head=False, fields=None):
+        '''
+        Sends a request to retrieve a range of resources and records the
+        headers of the response.
+        @param offset:int Offset
+        @param limit:int Limit (Max: 200)
+        @param head:bool A value indicating whether to use the HEAD HTTP
+        method.
+        @param fields:str Fields to retrieve
+        @return: Response
+        '''
+        response = self.__send_page_request(offset, limit, head, fields)
+        self.__content_range = response["Content-Range"]
+        self.__etag = response["Etag"]
+        return response
+
+
+    def __send_page_request(self, offset, limit, head=False, fields=None):
+        '''
+        Sends a request to retrieve a range of resources.
+        @param offset:int Offset
+        @param limit:int Limit (Max: 200)
+        @param head:bool A value indicating whether to use the HEAD HTTP
+        method.
+        @param fields:str Fields to retrieve
+        @return: Response
+        '''
         uri = self.__uri
 
         if not is_empty_or_none(fields):
@@ -447,32 +1050,157 @@ class Collection(object):
             request["If-Modified-Since"] = self.__etag.last_modified
 
 
-        response = request.get_response()
-        self.__content_range = response["Content-Range"]
-        self.__etag = response["Etag"]
+        return request.get_response(stream=not head)
 
-        if response.status_code in [204, 416]: #(No-Content, Out-Range)
-            self.__resources = {}
-            self.__list = []
-            return
 
-        if response.status_code not in [200, 206]: #(OK, Partial Content)
-            return Exception("Unexpected response from the server (code: %s)"
-                             % response.status_code)
+    def __read_page(self, response, partial=False):
+        '''
+        Returns the resources found in the body of a response.
+        @param response:Response
+        @param partial:bool A value indicating whether only some of the
+        fields were retrieved.
+        @return: list
+        '''
+        page = []
+        for item in response.iter_data():
+            etag = Etag.parse(item["etag"])
+            resource = self.__node[etag.id]
+            resource.sync(item, etag, partial)
+            page.append(resource)
 
-        if not head:
-            self.__resources = {}
-            self.__list = []
-            for item in response.data:
-                etag = Etag.parse(item["etag"])
-                resource = self.__node[etag.id]
-                resource.sync(item, etag)
+        return page
+
+
+    def __load_pages(self, pages):
+        '''
+        Replaces the resources of the collection with those of a list of pages.
+        @param pages:list List of pages
+        '''
+        self.__resources = {}
+        self.__list = []
+        for page in pages:
+            for resource in page:
                 self.__list.append(resource)
                 self.__resources[str(resource.id)] = resource
 
 
 
 
+class IdentityMap(object):
+    '''
+    Maps each (class, URI) pair to a single live resource instance, so that
+    the data already retrieved for a resource is shared.
+    Resources are held through weak references. The last resources used can
+    also be kept alive to be reused later, and resources with pending updates
+    are kept alive until their updates are sent.
+    '''
+    def __init__(self, size=0):
+        '''
+        Initializes a new instance of the IdentityMap class.
+        @param size:int Number of recently used resources to keep alive.
+        '''
+        self.__resources = WeakValueDictionary()
+        self.__recent = deque(maxlen=size) if size else None
+        self.__dirty = {}
+        self.__lock = threading.Lock()
+
+
+    def __len__(self):
+        '''
+        Returns the number of live resources in the map.
+        @return: int
+        '''
+        return len(self.__resources)
+
+
+    def get(self, resource_cls, uri):
+        '''
+        Gets a resource by its class and URI, or None.
+        @param resource_cls:Class Class of the resource
+        @param uri:str URI of the resource
+        @return: Resource
+        '''
+        return self.__resources.get((resource_cls, uri), None)
+
+
+    def add(self, resource):
+        '''
+        Adds a resource to the map, unless an instance with the same class
+        and URI is already there.
+        @param resource:Resource Resource to add
+        @return: Resource The instance held by the map
+        '''
+        key = (resource.__class__, resource.uri)
+        self.__lock.acquire()
+        try:
+            resource = self.__resources.setdefault(key, resource)
+            if self.__recent is not None:
+                self.__recent.append(resource)
+
+            return resource
+        finally:
+            self.__lock.release()
+
+
+    def set_dirty(self, resource, dirty=True):
+        '''
+        Holds a resource with pending updates, or releases it once they have
+        been sent.
+        @param resource:Resource Resource
+        @param dirty:bool A value indicating whether the resource has pending
+        updates.
+        '''
+        key = (resource.__class__, resource.uri)
+        self.__lock.acquire()
+        try:
+            if dirty:
+                self.__dirty[key] = resource
+            elif self.__dirty.get(key, None) is resource:
+                del self.__dirty[key]
+        finally:
+            self.__lock.release()
+
+
+    @property
+    def dirty(self):
+        '''
+        Gets the resources with pending updates.
+        @return: list
+        '''
+        self.__lock.acquire()
+        try:
+            return self.__dirty.values()
+        finally:
+            self.__lock.release()
+
+
+    def __iter__(self):
+        '''
+        Iterates over a snapshot of the live resources of the map.
+        '''
+        self.__lock.acquire()
+        try:
+            return iter(self.__resources.values())
+        finally:
+            self.__lock.release()
+
+
+    def clear(self):
+        '''
+        Removes all the resources from the map.
+        '''
+        self.__lock.acquire()
+        try:
+            self.__resources.clear()
+            self.__dirty.clear()
+            if self.__recent is not None:
+                self.__recent.clear()
+        finally:
+            self.__lock.release()
+
+
+
+
 class Node(object):
     '''
     Represents a node to access a certain type of resources
@@ -520,9 +1248,16 @@ class Node(object):
                   if k not in ['default', 'check_existence']]
         instance = self._resource_cls(*args, **dict(params))
 
+        identity_map = getattr(self.__client, "identity_map", None)
+        if identity_map is not None:
+            instance = identity_map.add(instance)
+
         if not kwargs.get('check_existence', True) or 'default' not in kwargs:
             return instance
 
+        if instance.is_loaded:
+            return instance
+
         try:
             instance.load()
             return instance
@@ -551,6 +1286,78 @@ class Node(object):
         return self.search()
 
 
+    def hydrate(self, resources, fields=None):
+        '''
+        Loads a list of resources with as few requests as possible, by
+        querying the node for up to RESPONSE_SIZE_LIMIT IDs at a time.
+        Resources already loaded or deleted are left untouched.
+        @param resources:list Resources accessible from this node
+        @param fields:str Fields to retrieve
+        @return: list Resources that could not be found
+        '''
+        pending = {}
+        for resource in resources:
+            if not resource.is_loaded and not resource.is_deleted:
+                pending.setdefault(str(resource.id), []).append(resource)
+
+        identifiers = pending.keys()
+        for index in xrange(0, len(identifiers), RESPONSE_SIZE_LIMIT):
+            chunk = identifiers[index:index + RESPONSE_SIZE_LIMIT]
+            uri = self._uri + "?q=" + urllib.quote_plus("id==" +
+                                                        ",".join(chunk))
+            if not is_empty_or_none(fields):
+                uri += "&fields=" + urllib.quote_plus(fields)
+
+            request = Request(self.__client, uri=uri, method="GET")
+            request["Range"] = Range(offset=0, limit=len(chunk))
+            response = request.get_response(stream=True)
+            if response.status_code in [204, 416]: #(No-Content, Out-Range)
+                continue
+
+            if response.status_code not in [200, 206]: #(OK, Partial Content)
+                raise Exception("Unexpected response from the server "
+                                "(code: %s)" % response.status_code)
+
+            for item in response.iter_data():
+                etag = Etag.parse(item["etag"])
+                for resource in pending.pop(str(etag.id), []):
+                    resource.sync(dict(item), etag,
+                                  not is_empty_or_none(fields))
+
+        return [ resource for group in pending.values() for resource in group ]
+
+
+    def update_all(self, resources=None, prevent_conflicts=False,
+                   concurrency=POOL_SIZE):
+        '''
+        Sends the updates registered on a number of resources concurrently,
+        over the pooled connections.
+        @param resources:list Resources of this node to update. Defaults to
+        the resources with pending updates held by the identity map of the
+        client, even if they are no longer referenced elsewhere.
+        @param prevent_conflicts:bool A value indicating whether resources
+        should not be updated if their current version is not the most
+        recent one available. Resources which have never been loaded have no
+        known version, and are updated unconditionally.
+        @param concurrency:int Maximum number of concurrent requests
+        @return: BatchResult
+        '''
+        if resources is None:
+            identity_map = getattr(self.__client, "identity_map", None)
+            dirty = identity_map.dirty if identity_map is not None else []
+            resources = [ resource for resource in dirty
+                          if isinstance(resource, self._resource_cls)
+                          and resource.uri.startswith(self._uri) ]
+
+        resources = [ resource for resource in resources
+                      if len(resource.pending_updates) ]
+        def update(resource):
+            resource.update(prevent_conflicts and
+                            resource.etag.last_modified != datetime(1970, 1, 1))
+
+        return run_batch(update, resources, concurrency)
+
+
     def search(self, query=""):
         '''
         Returns a collection to filter the resources accessible from this node.
@@ -0,0 +1,421 @@
+import re
+import time
+import zlib
+import hashlib
+import threading
+import simplejson
+from urlparse import urlparse, parse_qs
+from greendizer.http import (Transport, Headers, API_ROOT, COMPRESSION_GZIP,
+                             COMPRESSION_DEFLATE)
+
+
+
+
+RESPONSE_SIZE_LIMIT = 200
+COLLECTIONS = ["sellers", "buyers", "emails", "invoices", "reports", "threads",
+               "messages"]
+QUERY_TERM = re.compile(r'^(?P<field>\w+)(?P<operator>==|!=|<<|>>)'
+                        r'(?P<value>.*)$')
+
+
+
+
+class FakeServer(Transport):
+    '''
+    Represents an in-memory implementation of the Greendizer API, to run and
+    benchmark the library offline.
+    Resources are stored by URI, and collections hold the resources found
+    right below them. Set it as the transport of a client to use it.
+    '''
+    def __init__(self, latency=0, compress=False):
+        '''
+        Initializes a new instance of the FakeServer class.
+        @param latency:float Number of seconds to wait before answering.
+        @param compress:bool A value indicating whether to compress the
+        responses when the client accepts it.
+        '''
+        self.latency = latency
+        self.compress = compress
+        self.__resources = {}
+        self.__collections = {}
+        self.__lock = threading.RLock()
+        self.__clock = 0
+        self.__sequence = 0
+        self.__requests = 0
+
+
+    @property
+    def requests(self):
+        '''
+        Gets the number of requests received.
+        @return: int
+        '''
+        return self.__requests
+
+
+    def __tick(self):
+        '''
+        Returns a strictly increasing timestamp, in milliseconds.
+        @return: long
+        '''
+        self.__clock = max(self.__clock + 1, long(time.time() * 1000))
+        return self.__clock
+
+
+    def __path(self, url):
+        '''
+        Returns the URI of a resource relative to the API root.
+        @param url:str Absolute URL
+        @return: tuple (uri, query parameters)
+        '''
+        parsed = urlparse(url)
+        root = urlparse(API_ROOT).path
+        path = parsed.path
+        if path.startswith(root):
+            path = path[len(root):]
+
+        return path.lstrip("/"), parse_qs(parsed.query)
+
+
+    def add(self, collection, data=None, identifier=None):
+        '''
+        Adds a resource to a collection.
+        @param collection:str URI of the collection, ending with a slash.
+        @param data:dict Attributes of the resource
+        @param identifier:str ID of the resource, generated if None.
+        @return: str URI of the resource
+        '''
+        self.__lock.acquire()
+        try:
+            if identifier is None:
+                self.__sequence += 1
+                identifier = str(self.__sequence)
+
+            uri = "%s%s/" % (collection, identifier)
+            if uri not in self.__resources:
+                self.__collections.setdefault(collection, []).append(uri)
+
+            self.__resources[uri] = {"id": str(identifier),
+                                     "data": dict(data or {}),
+                                     "modified": self.__tick()}
+            return uri
+        finally:
+            self.__lock.release()
+
+
+    def get(self, uri):
+        '''
+        Gets the attributes of a resource, or None.
+        @param uri:str URI of the resource
+        @return: dict
+        '''
+        self.__lock.acquire()
+        try:
+            resource = self.__resources.get(uri, None)
+            return dict(resource["data"]) if resource else None
+        finally:
+            self.__lock.release()
+
+
+    def remove(self, uri):
+        '''
+        Removes a resource.
+        @param uri:str URI of the resource
+        '''
+        self.__lock.acquire()
+        try:
+            if self.__resources.pop(uri, None):
+                collection = uri[:uri.rstrip("/").rfind("/") + 1]
+                self.__collections[collection].remove(uri)
+        finally:
+            self.__lock.release()
+
+
+    def seed(self, user="sellers/me/", emails=1, invoices=0, buyers=0,
+             threads=0):
+        '''
+        Creates a user with a number of sample resources.
+        @param user:str URI of the user (sellers/me/ or buyers/me/)
+        @param emails:int Number of email addresses
+        @param invoices:int Number of invoices per email address
+        @param buyers:int Number of buyers (sellers only)
+        @param threads:int Number of conversation threads
+        '''
+        self.add(user[:-3], {"name": "Sample"}, "me")
+        self.add(user, {"firstname": "Sample", "lastname": "User"}, "company")
+        for index in xrange(emails):
+            address = "email%d@example.com" % index
+            email = self.add(user + "emails/",
+                             {"label": "Email %d" % index,
+                              "address": address,
+                              "invoicesCount": invoices},
+                             hashlib.sha1(address).hexdigest())
+            for number in xrange(invoices):
+                self.add(email + "invoices/",
+                         {"name": "Invoice %d" % number,
+                          "customId": "INV%06d" % number,
+                          "currency": "EUR", "total": number * 10,
+                          "read": 0, "flagged": 0, "paid": 0,
+                          "canceled": 0, "location": 0, "buyer": {"uri":
+                                          "%sbuyers/%d/" % (user, number %
+                                                            max(1, buyers))}})
+
+        for index in xrange(buyers):
+            self.add(user + "buyers/", {"name": "Buyer %d" % index,
+                                        "invoicesCount": 0}, index)
+
+        for index in xrange(threads):
+            thread = self.add(user + "threads/",
+                              {"subject": "Thread %d" % index,
+                               "messagesCount": 1, "read": 0})
+            self.add(thread + "messages/", {"text": "Hello"})
+
+
+    def urlopen(self, method, url, body=None, headers=None, stream=False,
+                timings=None):
+        '''
+        Handles an HTTP request.
+        @param method:str HTTP method
+        @param url:str Absolute URL
+        @param body:str Encoded body, or function returning its chunks.
+        @param headers:dict HTTP headers
+        @param stream:bool Ignored, bodies are returned as strings.
+        @param timings:dict Ignored, no stage is measured.
+        @return: tuple (status, info, data)
+        '''
+        if self.latency:
+            time.sleep(self.latency)
+
+        headers = Headers((headers or {}).items())
+        method = headers.getheader("X-HTTP-Method-Override", method).upper()
+        if callable(body):
+            body = "".join(body())
+
+        if body and headers.getheader("Content-Encoding", None):
+            body = zlib.decompress(body, 32 + zlib.MAX_WBITS)
+
+        uri, query = self.__path(url)
+        self.__lock.acquire()
+        try:
+            self.__requests += 1
+            if uri in self.__resources and method != "POST":
+                status, extra, data = self.__handle_resource(method, uri,
+                                                             headers, body)
+            elif (uri in self.__collections
+                  or uri.rstrip("/").split("/")[-1] in COLLECTIONS):
+                status, extra, data = self.__handle_collection(method, uri,
+                                                               query, headers,
+                                                               body)
+            else:
+                status, extra, data = 404, {}, {"desc": "Not found."}
+        finally:
+            self.__lock.release()
+
+        return self.__respond(method, status, extra, data, headers)
+
+
+    def __respond(self, method, status, extra, data, headers):
+        '''
+        Serializes a response.
+        @param method:str HTTP method
+        @param status:int Status code
+        @param extra:dict Headers of the response
+        @param data:object JSON body, or None
+        @param headers:Headers Headers of the request
+        @return: tuple (status, info, data)
+        '''
+        body = ""
+        if data is not None and method != "HEAD":
+            body = simplejson.dumps(data)
+
+        encodings = headers.getheader("Accept-Encoding", "")
+        if self.compress and body and COMPRESSION_GZIP in encodings:
+            compressor = zlib.compressobj(6, zlib.DEFLATED,
+                                          16 + zlib.MAX_WBITS)
+            body = compressor.compress(body) + compressor.flush()
+            extra["Content-Encoding"] = COMPRESSION_GZIP
+        elif self.compress and body and COMPRESSION_DEFLATE in encodings:
+            body = zlib.compress(body, 6)
+            extra["Content-Encoding"] = COMPRESSION_DEFLATE
+
+        extra["Content-Length"] = str(len(body))
+        return status, Headers(extra.items()), body
+
+
+    def __etag(self, resource):
+        '''
+        Returns the Etag of a resource.
+        @param resource:dict
+        @return: str
+        '''
+        return "%d-%s" % (resource["modified"], resource["id"])
+
+
+    def __serialize(self, resource, fields=None):
+        '''
+        Returns the JSON representation of a resource.
+        @param resource:dict
+        @param fields:list Fields to include, or None for all.
+        @return: dict
+        '''
+        data = dict([ (name, value)
+                      for name, value in resource["data"].items()
+                      if not fields or name in fields ])
+        data["etag"] = self.__etag(resource)
+        return data
+
+
+    def __handle_resource(self, method, uri, headers, body):
+        '''
+        Handles a request sent to a resource.
+        @return: tuple (status, headers, data)
+        '''
+        resource = self.__resources[uri]
+        etag = self.__etag(resource)
+        if method in ["GET", "HEAD"]:
+            if headers.getheader("If-None-Match", None) == etag:
+                return 304, {"Etag": etag}, None
+
+            return 200, {"Etag": etag}, self.__serialize(resource)
+
+        if method not in ["PATCH", "PUT", "DELETE"]:
+            return 405, {}, {"desc": "Method not allowed."}
+
+        expected = headers.getheader("If-Match", None)
+        if expected and expected != etag:
+            return 409, {"Etag": etag}, {"desc": "Conflict."}
+
+        if method == "DELETE":
+            self.remove(uri)
+            return 204, {}, None
+
+        updates = dict([ (name, values[-1]) for name, values
+                         in parse_qs(body or "", True).items() ])
+        if method == "PUT":
+            resource["data"] = updates
+        else:
+            resource["data"].update(updates)
+
+        resource["modified"] = self.__tick()
+        return 204, {"Etag": self.__etag(resource)}, None
+
+
+    def __handle_collection(self, method, uri, query, headers, body):
+        '''
+        Handles a request sent to a collection.
+        @return: tuple (status, headers, data)
+        '''
+        if method == "POST":
+            return self.__create(uri, headers, body)
+
+        if method not in ["GET", "HEAD"]:
+            return 405, {}, {"desc": "Method not allowed."}
+
+        matches = [ self.__resources[item]
+                    for item in self.__collections.get(uri, [])
+                    if self.__match(self.__resources[item],
+                                    query.get("q", [""])[0]) ]
+        total = len(matches)
+        etag = "%d-%d" % (max([0] + [ item["modified"]
+                                      for item in matches ]), total)
+        if headers.getheader("If-None-Match", None) == etag:
+            return 304, {"Etag": etag}, None
+
+        if not total:
+            return 204, {"Etag": etag}, None
+
+        offset, limit = 0, RESPONSE_SIZE_LIMIT
+        match = re.match(r'^\w+=(\d+)-(\d+)$',
+                         headers.getheader("Range", "") or "")
+        if match:
+            offset = int(match.group(1))
+            limit = min(RESPONSE_SIZE_LIMIT, int(match.group(2)))
+
+        if offset >= total:
+            return 416, {"Etag": etag,
+                         "Content-Range": "resources */%d" % total}, None
+
+        fields = None
+        if query.get("fields"):
+            fields = query["fields"][0].split(",")
+
+        page = matches[offset:offset + limit]
+        extra = {"Etag": etag,
+                 "Content-Range": "resources %d-%d/%d" % (offset,
+                                                          offset + len(page)
+                                                          - 1, total)}
+        return ((206 if len(page) < total else 200), extra,
+                [ self.__serialize(item, fields) for item in page ])
+
+
+    def __match(self, resource, query):
+        '''
+        Gets a value indicating whether a resource matches a query. Terms are
+        separated by | and must all be satisfied; values separated by commas
+        are alternatives of an equality test.
+        @param resource:dict
+        @param query:str Query
+        @return: bool
+        '''
+        for term in (query or "").split("|"):
+            match = QUERY_TERM.match(term.strip())
+            if not match:
+                continue
+
+            field, operator, value = match.groups()
+            if field == "id":
+                actual = resource["id"]
+            elif field == "lastModified":
+                actual = resource["modified"]
+            else:
+                actual = resource["data"].get(field, None)
+
+            if operator in ["==", "!="]:
+                if (str(actual) in value.split(",")) != (operator == "=="):
+                    return False
+
+                continue
+
+            try:
+                actual, value = float(actual), float(value)
+            except (TypeError, ValueError):
+                return False
+
+            if (operator == "<<" and actual >= value
+                or operator == ">>" and actual <= value):
+                return False
+
+        return True
+
+
+    def __create(self, uri, headers, body):
+        '''
+        Creates a resource inside a collection.
+        @return: tuple (status, headers, data)
+        '''
+        content_type = headers.getheader("Content-Type", "") or ""
+        if content_type.startswith("application/xml"):
+            if not uri.endswith("invoices/"):
+                return 415, {}, {"desc": "Unsupported media type."}
+
+            now = self.__tick()
+            location = self.add(uri + "reports/", {
+                "state": 3,
+                "ipAddress": "127.0.0.1",
+                "hash": hashlib.sha1(body or "").hexdigest(),
+                "invoicesCount": len(re.findall(r'<invoice[\s>]', body or "")),
+                "startTime": now,
+                "elapsedTime": 0
+            })
+            return 202, {"Location": API_ROOT + location}, None
+
+        data = dict([ (name, values[-1]) for name, values
+                      in parse_qs(body or "", True).items() ])
+        location = self.add(uri, data)
+        resource = self.__resources[location]
+        if uri.endswith("threads/") and "message" in data:
+            self.add(location + "messages/", {"text": data["message"]})
+
+        return (201, {"Location": API_ROOT + location,
+                      "Etag": self.__etag(resource)},
+                self.__serialize(resource))
@@ -1,14 +1,25 @@
 import time
-import urllib, urllib2
+import random
+import urllib
+import httplib
+import socket
+import select
+import threading
 import simplejson
 import re
 import zlib
+import codecs
+import traceback
+from multiprocessing.pool import ThreadPool
+from urlparse import urlparse
+from email.utils import parsedate_tz, mktime_tz
 from datetime import datetime, date
-from gzip import GzipFile
 from StringIO import StringIO
 import greendizer
 from greendizer.base import (is_empty_or_none, timestamp_to_datetime,
                              datetime_to_timestamp)
+from greendizer.cache import CacheEntry
+from greendizer.instrumentation import Span, get_uri_template
 
 
 
@@ -19,6 +30,22 @@ API_ROOT = "https://api.greendizer.com/"
 USE_GZIP = True
 HTTP_METHODS = ["head", "get", "post", "put", "patch", "delete", "options"]
 CONTENT_TYPES = ["application/xml", "application/x-www-form-urlencoded"]
+POOL_SIZE = 4
+POOL_IDLE_TIMEOUT = 60 #seconds
+EXECUTOR_SIZE = 16
+COMPRESSION_LEVEL = 6
+COMPRESSION_MIN_SIZE = 1024 #bytes
+COMPRESSION_CHUNK_SIZE = 64 * 1024 #bytes
+RESPONSE_CHUNK_SIZE = 64 * 1024 #bytes
+RETRY_ATTEMPTS = 4
+RETRY_BACKOFF = 0.5 #seconds
+RETRY_MAX_BACKOFF = 30 #seconds
+RETRY_DEADLINE = 120 #seconds
+RETRY_STATUSES = [502, 503, 504]
+IDEMPOTENT_METHODS = ["GET", "HEAD", "PUT", "DELETE", "OPTIONS"]
+CONDITIONAL_HEADERS = ["If-None-Match", "If-Modified-Since"]
+SAFE_METHODS = ["GET", "HEAD", "OPTIONS"]
+JSON_WHITESPACE = re.compile(r'[ \t\n\r]*')
 
 
 
@@ -55,34 +82,301 @@ class ApiException(Exception):
 
 
 
-class Request(object):
+class CompressionPolicy(object):
     '''
-    Represents an HTTP request to the Greendizer API
+    Represents the way request bodies are compressed before being sent.
+    '''
+    def __init__(self, algorithm=COMPRESSION_GZIP, level=COMPRESSION_LEVEL,
+                 min_size=COMPRESSION_MIN_SIZE, streaming=False):
+        '''
+        Initializes a new instance of the CompressionPolicy class.
+        @param algorithm:str Compression algorithm (gzip or deflate)
+        @param level:int Compression level, from 1 (fastest) to 9 (smallest)
+        @param min_size:int Size in bytes below which bodies are sent
+        uncompressed.
+        @param streaming:bool A value indicating whether to compress bodies
+        while they are written to the socket, using chunked transfer
+        encoding, instead of computing their length first.
+        '''
+        if algorithm not in [COMPRESSION_GZIP, COMPRESSION_DEFLATE]:
+            raise ValueError("Invalid compression algorithm.")
+
+        if level not in range(1, 10):
+            raise ValueError("Compression level must be between 1 and 9.")
+
+        self.__algorithm = algorithm
+        self.__level = level
+        self.min_size = min_size
+        self.streaming = streaming
+
+
+    @property
+    def algorithm(self):
+        '''
+        Gets the compression algorithm, used as the Content-Encoding value.
+        @return: str
+        '''
+        return self.__algorithm
+
+
+    @property
+    def level(self):
+        '''
+        Gets the compression level.
+        @return: int
+        '''
+        return self.__level
+
+
+    def applies_to(self, data):
+        '''
+        Gets a value indicating whether a body should be compressed.
+        @param data:str Encoded body
+        @return: bool
+        '''
+        return len(data) >= self.min_size
+
+
+    def compress(self, data):
+        '''
+        Compresses a body chunk by chunk.
+        @param data:str Encoded body
+        @return: generator of compressed chunks
+        '''
+        wbits = zlib.MAX_WBITS
+        if self.__algorithm == COMPRESSION_GZIP:
+            wbits += 16 #GZip header and trailer
+
+        compressor = zlib.compressobj(self.__level, zlib.DEFLATED, wbits)
+        view = buffer(data)
+        for index in xrange(0, len(data), COMPRESSION_CHUNK_SIZE):
+            chunk = compressor.compress(view[index:index +
+                                             COMPRESSION_CHUNK_SIZE])
+            if chunk:
+                yield chunk
+
+        yield compressor.flush()
+
+
+
+
+class RetryPolicy(object):
     '''
-    class HttpRequest(urllib2.Request):
+    Represents the way idempotent requests are retried after a network
+    error or a transient server error, with exponential backoff and jitter.
+    '''
+    def __init__(self, attempts=RETRY_ATTEMPTS, backoff=RETRY_BACKOFF,
+                 max_backoff=RETRY_MAX_BACKOFF, deadline=RETRY_DEADLINE,
+                 statuses=RETRY_STATUSES, jitter=True):
         '''
-        Represents an HTTP request
-        This class inherits from the urllib2 Request class to extend the
-        HTTP methods available beyond the GET and POST already built-in.
+        Initializes a new instance of the RetryPolicy class.
+        @param attempts:int Maximum number of attempts per request
+        @param backoff:float Delay in seconds before the first retry, doubled
+        after each attempt.
+        @param max_backoff:float Maximum delay in seconds between two
+        attempts.
+        @param deadline:float Number of seconds after which a request is no
+        longer retried.
+        @param statuses:list Status codes considered transient.
+        @param jitter:bool A value indicating whether to randomize the delays
+        to spread the retries of concurrent requests.
         '''
-        def __init__(self, uri, method="GET", **kwargs):
-            '''
-            Initializes a new instance of the Request class.
-            @param uri:str The URI to which will be bound.
-            @param method:str The HTTP method to use with the request.
-            '''
-            self.__method = method
-            urllib2.Request.__init__(self, uri, **kwargs)
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.deadline = deadline
+        self.statuses = statuses
+        self.jitter = jitter
+        self.__lock = threading.Lock()
+        self.reset_metrics()
+
 
+    @property
+    def metrics(self):
+        '''
+        Gets the number of requests sent, of attempts made, of retries, of
+        requests which failed after all their attempts, and the total number
+        of seconds spent waiting between attempts.
+        @return: dict
+        '''
+        self.__lock.acquire()
+        try:
+            return dict(self.__metrics)
+        finally:
+            self.__lock.release()
 
-        def get_method(self):
-            '''
-            Gets the HTTP method in use.
-            @return: str
-            '''
-            return self.__method
+
+    def reset_metrics(self):
+        '''
+        Resets the metrics.
+        '''
+        self.__lock.acquire()
+        try:
+            self.__metrics = {"requests": 0, "attempts": 0, "retries": 0,
+                              "exhausted": 0, "waited": 0.0}
+        finally:
+            self.__lock.release()
+
+
+    def record(self, metric, value=1):
+        '''
+        Adds a value to a metric.
+        @param metric:str Metric name
+        @param value:number Value to add
+        '''
+        self.__lock.acquire()
+        try:
+            self.__metrics[metric] += value
+        finally:
+            self.__lock.release()
+
+
+    def is_retryable(self, method, headers):
+        '''
+        Gets a value indicating whether a request can be sent again safely.
+        PATCH requests are only retried when they carry an If-Match header.
+        @param method:str HTTP method
+        @param headers:dict HTTP headers
+        @return: bool
+        '''
+        return (method in IDEMPOTENT_METHODS
+                or (method == "PATCH" and "If-Match" in headers))
+
+
+    def get_delay(self, attempt, retry_after=None):
+        '''
+        Computes the number of seconds to wait before the next attempt.
+        @param attempt:int Number of attempts made so far
+        @param retry_after:str Value of the Retry-After header, if any.
+        @return: float
+        '''
+        delay = min(self.max_backoff, self.backoff * (2 ** (attempt - 1)))
+        if self.jitter:
+            delay = random.uniform(delay / 2, delay)
+
+        if retry_after:
+            if retry_after.strip().isdigit():
+                delay = max(delay, int(retry_after))
+            elif parsedate_tz(retry_after):
+                delay = max(delay, mktime_tz(parsedate_tz(retry_after))
+                                   - time.time())
+
+        return delay
+
+
+    def allows(self, attempt, started, delay):
+        '''
+        Gets a value indicating whether another attempt can be made.
+        @param attempt:int Number of attempts made so far
+        @param started:float Time at which the first attempt was made
+        @param delay:float Number of seconds to wait before the next attempt
+        @return: bool
+        '''
+        return (attempt < self.attempts
+                and time.time() + delay - started <= self.deadline)
+
+
+
+
+class RateLimiter(object):
+    '''
+    Limits the rate at which requests are sent with a token bucket, and the
+    number of requests in flight at the same time.
+    '''
+    def __init__(self, rate=None, burst=None, max_in_flight=None):
+        '''
+        Initializes a new instance of the RateLimiter class.
+        @param rate:float Maximum number of requests per second, or None.
+        @param burst:int Number of requests which can be sent at once after
+        an idle period. Defaults to the rate.
+        @param max_in_flight:int Maximum number of concurrent requests, or
+        None.
+        '''
+        if rate is not None and rate <= 0:
+            raise ValueError("Rate must be positive.")
+
+        self.__rate = rate
+        self.__burst = max(1, burst or int(rate or 1))
+        self.__tokens = float(self.__burst)
+        self.__updated = time.time()
+        self.__slots = (threading.BoundedSemaphore(max_in_flight)
+                        if max_in_flight else None)
+        self.__lock = threading.Lock()
+        self.__in_flight = 0
+        self.__waited = 0.0
+
+
+    @property
+    def in_flight(self):
+        '''
+        Gets the number of requests being sent.
+        @return: int
+        '''
+        return self.__in_flight
 
 
+    @property
+    def waited(self):
+        '''
+        Gets the total number of seconds requests were held back.
+        @return: float
+        '''
+        return self.__waited
+
+
+    def acquire(self):
+        '''
+        Blocks until a request can be sent.
+        '''
+        started = time.time()
+        if self.__slots:
+            self.__slots.acquire()
+
+        while self.__rate:
+            self.__lock.acquire()
+            try:
+                now = time.time()
+                self.__tokens = min(self.__burst, self.__tokens +
+                                    (now - self.__updated) * self.__rate)
+                self.__updated = now
+                if self.__tokens >= 1:
+                    self.__tokens -= 1
+                    break
+
+                delay = (1 - self.__tokens) / self.__rate
+            finally:
+                self.__lock.release()
+
+            time.sleep(delay)
+
+        self.__lock.acquire()
+        try:
+            self.__in_flight += 1
+            self.__waited += time.time() - started
+        finally:
+            self.__lock.release()
+
+
+    def release(self):
+        '''
+        Signals that a request has been answered.
+        '''
+        self.__lock.acquire()
+        try:
+            self.__in_flight -= 1
+        finally:
+            self.__lock.release()
+
+        if self.__slots:
+            self.__slots.release()
+
+
+
+
+class Request(object):
+    '''
+    Represents an HTTP request to the Greendizer API
+    '''
     def __init__(self, client=None, method="GET", uri=None, data=None,
                  content_type="application/x-www-form-urlencoded"):
         '''
@@ -105,6 +399,7 @@ class Request(object):
             raise ValueError("Data is not expected to be None.")
 
         self.__content_type = content_type
+        self.__client = client
         self.data = data
         self.uri = uri
         self.method = method
@@ -157,11 +452,24 @@ class Request(object):
         return serialized
 
 
-    def get_response(self):
+    def get_response_async(self, callback=None):
+        '''
+        Sends the request on the executor of the client without blocking.
+        @param callback:function Function called with the response.
+        @return: AsyncResult
+        '''
+        return submit(self.__client, self.get_response, callback=callback)
+
+
+    def get_response(self, stream=False):
         '''
         Sends the request and returns an HTTP response object.
+        @param stream:bool A value indicating whether to leave the body on
+        the socket until it is read, to iterate over it with
+        Response.iter_data.
         @return: Response
         '''
+        started = time.time()
         headers = self.__serialize_headers()
         headers.update({
             "Accept": "application/json",
@@ -181,35 +489,669 @@ class Request(object):
             if self.__content_type == "application/x-www-form-urlencoded":
                 encoded_data = unicode(urllib.urlencode(self.data))
             else:
-                if not greendizer.DEBUG and USE_GZIP:
-                    #Compress to GZip
-                    headers["Content-Encoding"] = COMPRESSION_GZIP
-                    bf = StringIO('')
-                    f = GzipFile(fileobj=bf, mode='wb', compresslevel=9)
-                    f.write(self.data.encode("utf-8"))
-                    f.close()
-                    encoded_data = bf.getvalue()
+                encoded_data = self.data.encode("utf-8")
+                policy = getattr(self.__client, "compression",
+                                 CompressionPolicy())
+                if (not greendizer.DEBUG and USE_GZIP and policy
+                    and policy.applies_to(encoded_data)):
+                    headers["Content-Encoding"] = policy.algorithm
+                    if policy.streaming:
+                        encoded_data = (lambda data=encoded_data:
+                                        policy.compress(data))
+                    else:
+                        encoded_data = "".join(policy.compress(encoded_data))
+
+        cache = getattr(self.__client, "cache", None)
+        cache_key = entry = None
+        if cache is not None and self.method == "GET":
+            cache_key = cache.get_key(self.uri, headers.get("Authorization",
+                                                            None),
+                                      headers.get("Range", None))
+            #A conditional request sent by the caller is answered by the
+            #server, as a 304 refers to the version the caller holds.
+            if not [ header for header in CONDITIONAL_HEADERS
+                     if header in headers ]:
+                entry = cache.get(cache_key)
+
+            if entry and cache.is_fresh(entry):
+                self.__emit("request", time.time() - started, 200,
+                            len(entry.data or ""))
+                return self.__get_cached_response(entry)
+
+            if entry:
+                headers["If-None-Match"] = entry.etag
+
+        stream = stream and not (cache is not None and self.method == "GET")
+        timings = {}
+        status, info, data = self.__send(method, encoded_data, headers, stream,
+                                         timings)
+        if hasattr(data, "read") and status not in [200, 206]:
+            #Only successful bodies are left on the socket, the others are
+            #read at once to release the connection.
+            data = read_body(data)
+
+        for name, duration in timings.items():
+            self.__emit(name, duration, status,
+                        len(data) if name == "download" else None)
+
+        sent = (len(encoded_data) if isinstance(encoded_data, basestring)
+                else 0)
+        streamed = hasattr(data, "read")
+        if not streamed:
+            self.__emit("request", time.time() - started, status,
+                        sent + len(data or ""))
+
+        if cache is not None and self.method not in SAFE_METHODS:
+            cache.invalidate(self.uri)
+        elif cache_key is not None:
+            if status == 304 and entry:
+                cache.set(cache_key, CacheEntry(entry.data, entry.etag,
+                                                entry.headers))
+                return self.__get_cached_response(entry, status)
+            elif status == 200 and info.getheader("Etag", None):
+                cache.set(cache_key, CacheEntry(data, info.getheader("Etag"),
+                                                info.items()))
+
+        instance = Response(self, status, data, info,
+                            self.__get_observer(status,
+                                                started if streamed else None,
+                                                sent))
+        if status >= 300 and status not in [304, 409, 416]:
+            raise ApiException(instance)
+
+        return instance
+
+
+    def __get_observer(self, status, started=None, sent=0):
+        '''
+        Returns a function emitting the spans measured by a response, or None
+        if the client has no hooks.
+        @param status:int Status code
+        @param started:float Time at which the request started, if its body
+        is streamed. The request span is then emitted once the body has been
+        downloaded, with the number of bytes received.
+        @param sent:int Number of bytes sent
+        @return: function
+        '''
+        if not getattr(self.__client, "hooks", None):
+            return
+
+        def observe(name, duration, size=None):
+            self.__emit(name, duration, status, size)
+            if started is not None and name == "download":
+                self.__emit("request", time.time() - started, status,
+                            sent + (size or 0))
+
+        return observe
+
+
+    def __emit(self, name, duration, status, size=None):
+        '''
+        Passes a span to the hooks of the client.
+        @param name:str Span name
+        @param duration:float Duration in seconds
+        @param status:int Status code
+        @param size:int Number of bytes processed
+        '''
+        hooks = getattr(self.__client, "hooks", None)
+        if not hooks:
+            return
+
+        span = Span(name, duration, {"method": self.method, "uri": self.uri,
+                                     "template": get_uri_template(self.uri),
+                                     "status": status}, size)
+        for hook in hooks:
+            hook(span)
+
+
+    def __send(self, method, encoded_data, headers, stream, timings):
+        '''
+        Sends the request through the transport of the client, retrying it
+        according to its retry policy.
+        @param method:str HTTP method
+        @param encoded_data:str Encoded body
+        @param headers:dict HTTP headers
+        @param stream:bool A value indicating whether to stream the body
+        @param timings:dict Dictionary in which the transport records the
+        duration of the stages of the exchange.
+        @return: tuple (status, info, data)
+        '''
+        policy = getattr(self.__client, "retry", RetryPolicy())
+        limiter = getattr(self.__client, "limiter", None)
+        transport = getattr(self.__client, "transport", None) or CONNECTION_POOL
+        retryable = policy and policy.is_retryable(self.method, headers)
+        if policy:
+            policy.record("requests")
+
+        started = time.time()
+        attempt = 0
+        while True:
+            attempt += 1
+            if policy:
+                policy.record("attempts")
+
+            error = data = None
+            if limiter:
+                limiter.acquire()
+
+            try:
+                try:
+                    status, info, data = transport.urlopen(method,
+                                                           API_ROOT + self.uri,
+                                                           encoded_data,
+                                                           headers, stream,
+                                                           timings)
+                finally:
+                    if limiter:
+                        limiter.release()
+
+                if not retryable or status not in policy.statuses:
+                    return status, info, data
+
+                delay = policy.get_delay(attempt,
+                                         info.getheader("Retry-After", None))
+            except (socket.error, httplib.HTTPException), e:
+                if not retryable:
+                    raise Exception("Unable to reach the server")
+
+                error = e
+                delay = policy.get_delay(attempt)
+
+            if not policy.allows(attempt, started, delay):
+                policy.record("exhausted")
+                if error:
+                    raise Exception("Unable to reach the server")
+
+                return status, info, data
+
+            if hasattr(data, "close"):
+                data.close()
+
+            policy.record("retries")
+            policy.record("waited", delay)
+            time.sleep(delay)
+
+
+    def __get_cached_response(self, entry, status=200):
+        '''
+        Returns a response built from a cache entry.
+        @param entry:CacheEntry
+        @param status:int Status code received from the server
+        @return: Response
+        '''
+        return Response(self, 200, entry.data, Headers(entry.headers),
+                        self.__get_observer(status))
+
+
+
+
+class Headers(object):
+    '''
+    Represents a set of HTTP headers with case-insensitive names.
+    '''
+    def __init__(self, items=()):
+        '''
+        Initializes a new instance of the Headers class.
+        @param items:list List of (name, value) tuples
+        '''
+        self.__items = list(items)
+        self.__values = dict([ (name.lower(), value)
+                               for name, value in self.__items ])
+
+
+    def getheader(self, name, default=None):
+        '''
+        Gets the value of a header
+        @param name:str Header name
+        @param default:object Value returned if the header is missing
+        @return: str
+        '''
+        return self.__values.get(name.lower(), default)
+
+
+    def items(self):
+        '''
+        Gets the list of headers
+        @return: list
+        '''
+        return list(self.__items)
+
+
+
+
+class Transport(object):
+    '''
+    Represents the way requests reach the Greendizer API.
+    '''
+    def urlopen(self, method, url, body=None, headers=None, stream=False,
+                timings=None):
+        '''
+        Sends an HTTP request.
+        @param method:str HTTP method
+        @param url:str Absolute URL
+        @param body:str Encoded body, or function returning the chunks of the
+        body.
+        @param headers:dict HTTP headers
+        @param stream:bool A value indicating whether the body of the
+        response can be returned as a file-like object.
+        @param timings:dict Dictionary in which the transport can record the
+        duration of the stages of the exchange (dns, connect, tls, ttfb,
+        download).
+        @return: tuple (status, info, data) where info has a getheader method.
+        '''
+        raise NotImplementedError()
+
+
+
+
+class ConnectionPool(Transport):
+    '''
+    Represents a pool of persistent (keep-alive) HTTP connections reused
+    across requests sent to the same host.
+    '''
+    def __init__(self, size=POOL_SIZE, idle_timeout=POOL_IDLE_TIMEOUT,
+                 timeout=socket._GLOBAL_DEFAULT_TIMEOUT):
+        '''
+        Initializes a new instance of the ConnectionPool class.
+        @param size:int Maximum number of idle connections kept per host.
+        @param idle_timeout:int Number of seconds after which an idle
+        connection is discarded.
+        @param timeout:float Socket timeout of the connections.
+        '''
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.__idle = {}
+        self.__lock = threading.Lock()
+        self.__hits = 0
+        self.__misses = 0
+
+
+    @property
+    def hits(self):
+        '''
+        Gets the number of requests served by a reused connection.
+        @return: int
+        '''
+        return self.__hits
+
+
+    @property
+    def misses(self):
+        '''
+        Gets the number of requests for which a new connection was opened.
+        @return: int
+        '''
+        return self.__misses
+
+
+    def acquire(self, scheme, host):
+        '''
+        Gets an idle connection to a host, or opens a new one.
+        @param scheme:str URI scheme (http or https)
+        @param host:str Host name and optional port
+        @return: tuple (connection, reused)
+        '''
+        now = time.time()
+        expired = []
+        self.__lock.acquire()
+        try:
+            idle = self.__idle.get((scheme, host), [])
+            while len(idle):
+                connection, released = idle.pop()
+                if (now - released <= self.idle_timeout
+                    and not self.__is_dropped(connection)):
+                    self.__hits += 1
+                    return connection, True
+
+                expired.append(connection)
+
+            self.__misses += 1
+        finally:
+            self.__lock.release()
+            for connection in expired:
+                connection.close()
+
+        if scheme == "https":
+            return httplib.HTTPSConnection(host, timeout=self.timeout), False
+
+        return httplib.HTTPConnection(host, timeout=self.timeout), False
+
+
+    def __is_dropped(self, connection):
+        '''
+        Gets a value indicating whether the server closed an idle connection.
+        An idle connection is not expected to have anything to read.
+        @param connection:HTTPConnection
+        @return: bool
+        '''
+        if not connection.sock:
+            return False
+
+        try:
+            return bool(select.select([connection.sock], [], [], 0)[0])
+        except (select.error, socket.error, ValueError):
+            return True
+
+
+    def release(self, scheme, host, connection):
+        '''
+        Puts a connection back into the pool.
+        @param scheme:str URI scheme (http or https)
+        @param host:str Host name and optional port
+        @param connection:HTTPConnection Connection to release
+        '''
+        self.__lock.acquire()
+        try:
+            idle = self.__idle.setdefault((scheme, host), [])
+            if len(idle) < self.size:
+                idle.append((connection, time.time()))
+                return
+        finally:
+            self.__lock.release()
+
+        connection.close()
+
+
+    def clear(self):
+        '''
+        Closes all the idle connections.
+        '''
+        self.__lock.acquire()
+        try:
+            idle, self.__idle = self.__idle, {}
+        finally:
+            self.__lock.release()
+
+        for connections in idle.values():
+            for connection, released in connections:
+                connection.close()
+
+
+    def urlopen(self, method, url, body=None, headers=None, stream=False,
+                timings=None):
+        '''
+        Sends an HTTP request over a pooled connection.
+        @param method:str HTTP method
+        @param url:str Absolute URL
+        @param body:str Encoded body, or function returning the chunks of the
+        body to send with chunked transfer encoding.
+        @param headers:dict HTTP headers
+        @param stream:bool A value indicating whether to return a reader
+        instead of the body. The connection is released once the reader
+        reaches the end of the body.
+        @param timings:dict Dictionary in which to record the duration of the
+        stages of the exchange.
+        @return: tuple (status, info, data)
+        '''
+        parsed = urlparse(url)
+        path = parsed.path + ("?" + parsed.query if parsed.query else "")
+        if timings is None:
+            timings = {}
+
+        while True:
+            connection, reused = self.acquire(parsed.scheme, parsed.netloc)
+            sent = False
+            response = None
+            try:
+                if not connection.sock:
+                    self.__connect(connection, timings)
+
+                started = time.time()
+                if callable(body):
+                    self.__send_chunked(connection, method, path, body(),
+                                        headers or {})
                 else:
-                    encoded_data = self.data.encode("utf-8")
+                    connection.request(method, path, body, headers or {})
+
+                sent = True
+                response = connection.getresponse()
+                timings["ttfb"] = time.time() - started
+                if stream and method != "HEAD" and response.length != 0:
+                    return (response.status, response.msg,
+                            PooledBody(self, parsed.scheme, parsed.netloc,
+                                       connection, response))
+
+                started = time.time()
+                data = response.read()
+                timings["download"] = time.time() - started
+            except (socket.error, httplib.HTTPException), e:
+                connection.close()
+                if reused and (not sent or (response is None
+                                            and method in IDEMPOTENT_METHODS
+                                            and not isinstance(e,
+                                                               socket.timeout))):
+                    #The server dropped the idle connection before handling
+                    #the request, try a new one. Requests which may have been
+                    #processed are only sent again if they are idempotent.
+                    continue
+
+                raise
+
+            if response.will_close:
+                connection.close()
+            else:
+                self.release(parsed.scheme, parsed.netloc, connection)
+
+            return response.status, response.msg, data
+
+
+    def __connect(self, connection, timings):
+        '''
+        Opens a connection, recording the time spent resolving the host name,
+        connecting and negotiating TLS. The host name is resolved once, and
+        the tunnel and TLS setup of httplib are kept.
+        @param connection:HTTPConnection
+        @param timings:dict
+        '''
+        https = isinstance(connection, httplib.HTTPSConnection)
+        if https and not getattr(connection, "_context", None):
+            #Older versions of httplib wrap the socket differently.
+            started = time.time()
+            connection.connect()
+            timings["connect"] = time.time() - started
+            return
+
+        started = time.time()
+        addresses = socket.getaddrinfo(connection.host, connection.port, 0,
+                                       socket.SOCK_STREAM)
+        timings["dns"] = time.time() - started
+
+        started = time.time()
+        connection.sock = self.__open_socket(addresses, connection.timeout,
+                                             connection.source_address)
+        if connection._tunnel_host:
+            connection._tunnel()
+
+        timings["connect"] = time.time() - started
+        if https:
+            started = time.time()
+            connection.sock = connection._context.wrap_socket(
+                connection.sock, server_hostname=(connection._tunnel_host
+                                                  or connection.host))
+            timings["tls"] = time.time() - started
+
+
+    def __open_socket(self, addresses, timeout, source_address=None):
+        '''
+        Connects a socket to the first reachable address of a host, like
+        socket.create_connection.
+        @param addresses:list Addresses returned by socket.getaddrinfo
+        @param timeout:float Socket timeout
+        @param source_address:tuple Local address to bind to
+        @return: socket
+        '''
+        error = socket.error("getaddrinfo returns an empty list")
+        for family, socktype, proto, canonname, address in addresses:
+            sock = None
+            try:
+                sock = socket.socket(family, socktype, proto)
+                if timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                    sock.settimeout(timeout)
+
+                if source_address:
+                    sock.bind(source_address)
+
+                sock.connect(address)
+                return sock
+            except socket.error, e:
+                error = e
+                if sock is not None:
+                    sock.close()
+
+        raise error
+
+
+    def __send_chunked(self, connection, method, path, chunks, headers):
+        '''
+        Sends a request which body is written with chunked transfer encoding.
+        @param connection:HTTPConnection
+        @param method:str HTTP method
+        @param path:str Path and query string
+        @param chunks:iterable Chunks of the body
+        @param headers:dict HTTP headers
+        '''
+        connection.putrequest(method, path, skip_accept_encoding=True)
+        for header, value in headers.items():
+            connection.putheader(header, value)
+
+        connection.putheader("Transfer-Encoding", "chunked")
+        connection.endheaders()
+        for chunk in chunks:
+            if chunk:
+                connection.send("%x\r\n%s\r\n" % (len(chunk), chunk))
+
+        connection.send("0\r\n\r\n")
+
+
+
+
+class PooledBody(object):
+    '''
+    Represents the body of a response being read from a pooled connection.
+    '''
+    def __init__(self, pool, scheme, host, connection, response):
+        '''
+        Initializes a new instance of the PooledBody class.
+        @param pool:ConnectionPool Pool owning the connection
+        @param scheme:str URI scheme (http or https)
+        @param host:str Host name and optional port
+        @param connection:HTTPConnection Connection to release
+        @param response:HTTPResponse Response which body is read
+        '''
+        self.__pool = pool
+        self.__scheme = scheme
+        self.__host = host
+        self.__connection = connection
+        self.__response = response
+
 
-        request = Request.HttpRequest(API_ROOT + self.uri, data=encoded_data,
-                                      method=method, headers=headers)
+    def read(self, size=None):
+        '''
+        Reads bytes from the body, releasing the connection at the end.
+        @param size:int Maximum number of bytes to read
+        @return: str
+        '''
+        if not self.__connection:
+            return ""
 
         try:
-            response = urllib2.urlopen(request)
-            return Response(self, 200, response.read().decode("utf-8"),
-                            response.info())
+            data = (self.__response.read(size) if size
+                    else self.__response.read())
+        except (socket.error, httplib.HTTPException):
+            self.close()
+            raise
+
+        if not data or self.__response.isclosed():
+            connection, self.__connection = self.__connection, None
+            if self.__response.will_close:
+                connection.close()
+            else:
+                self.__pool.release(self.__scheme, self.__host, connection)
+
+        return data
+
+
+    def close(self):
+        '''
+        Closes the connection if the body was not read to the end.
+        '''
+        if self.__connection:
+            self.__connection.close()
+            self.__connection = None
+
+
+
 
-        except(urllib2.HTTPError), e:
-            instance = Response(self, e.code, e.read().decode("utf-8"),
-                                e.info())
-            if e.code not in [201, 202, 204, 206, 304, 409, 416]:
-                raise ApiException(instance)
+CONNECTION_POOL = ConnectionPool()
+_executor = None
+_executor_lock = threading.Lock()
 
-            return instance
 
-        except urllib2.URLError:
-            raise Exception("Unable to reach the server")
+
+
+def read_body(body, size=None):
+    '''
+    Reads from the body of a response, reporting network failures like
+    those occurring before the response is received.
+    @param body:file File-like object
+    @param size:int Maximum number of bytes to read, or None to read the
+    whole body.
+    @return: str
+    '''
+    try:
+        return body.read(size) if size else body.read()
+    except (socket.error, httplib.HTTPException):
+        body.close()
+        raise Exception("Unable to reach the server")
+
+
+
+
+def get_executor(client=None):
+    '''
+    Returns the thread pool on which the asynchronous operations of a client
+    are run, or a pool shared by the requests sent without a client.
+    @param client:Client
+    @return: ThreadPool
+    '''
+    global _executor
+    executor = getattr(client, "executor", None)
+    if executor is not None:
+        return executor
+
+    _executor_lock.acquire()
+    try:
+        if not _executor:
+            _executor = ThreadPool(EXECUTOR_SIZE)
+
+        return _executor
+    finally:
+        _executor_lock.release()
+
+
+
+
+def submit(client, function, args=(), callback=None):
+    '''
+    Runs a function on the executor of a client.
+    @param client:Client
+    @param function:function Function to run
+    @param args:tuple Arguments of the function
+    @param callback:function Function called with the result. Exceptions
+    raised by the callback are printed and ignored, as they would otherwise
+    stop the thread delivering the results of the executor.
+    @return: AsyncResult Result which get() method blocks until the function
+    returns, and raises its exception if any.
+    '''
+    def notify(result):
+        try:
+            callback(result)
+        except Exception:
+            traceback.print_exc()
+
+    return get_executor(client).apply_async(function, args,
+                                            callback=callback and notify)
 
 
 
@@ -218,25 +1160,93 @@ class Response(object):
     '''
     Represents an HTTP response to a greendizer API Request
     '''
-    def __init__(self, request, status_code, data, info):
+    def __init__(self, request, status_code, data, info, observer=None):
         '''
         Initializes a new instance of the Response class.
         @param request:Request Request at the origin of this response
         @param status_code:int Status code
-        @param data:str Data carried in the body of the response
+        @param data:str Raw body of the response, or file-like object to
+        read it from.
         @param info:object Encapsulates methods to access the headers. 
+        @param observer:function Function called with the name, the duration
+        and the size of the stages of the processing of the body (download
+        when it is streamed, decompress and decode) once it has been read.
         '''
         self.__request = request
         self.__status_code = status_code
+        self.__streamed = hasattr(data, "read")
+        self.__body = data if self.__streamed else StringIO(data or "")
+        self.__info = info
+        self.__decoded = False
+        self.__json = None
+        self.__observer = observer
+        self.__timings = {}
 
-        content_encoding = info.getheader("Content-Encoding", None)
-        if content_encoding == COMPRESSION_DEFLATE:
-            data = zlib.decompress(data)
-        elif content_encoding == COMPRESSION_GZIP:
-            data = GzipFile(fileobj=StringIO(data)).read()
 
-        self.__data = data
-        self.__info = info
+    def __measure(self, name, started, size=0):
+        '''
+        Adds the time elapsed since a given time to a processing stage.
+        @param name:str Stage name
+        @param started:float Time at which the operation started
+        @param size:int Number of bytes processed
+        @return: float Current time
+        '''
+        now = time.time()
+        duration, total = self.__timings.get(name, (0.0, 0))
+        self.__timings[name] = (duration + now - started, total + size)
+        return now
+
+
+    def __report(self):
+        '''
+        Passes the duration of the processing stages to the observer.
+        '''
+        if self.__observer:
+            for name, (duration, size) in self.__timings.items():
+                self.__observer(name, duration, size)
+
+        self.__timings = {}
+
+
+    def __read_chunks(self):
+        '''
+        Reads the body, decompressing and decoding it chunk by chunk.
+        @return: generator of unicode strings
+        '''
+        body, self.__body = self.__body, StringIO("")
+        decompressor = None
+        if self.__info.getheader("Content-Encoding", None) in [
+                COMPRESSION_DEFLATE, COMPRESSION_GZIP]:
+            #Detects the zlib or gzip header automatically.
+            decompressor = zlib.decompressobj(32 + zlib.MAX_WBITS)
+
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        try:
+            while True:
+                started = time.time()
+                chunk = read_body(body, RESPONSE_CHUNK_SIZE)
+                if self.__streamed:
+                    started = self.__measure("download", started, len(chunk))
+
+                if not chunk:
+                    break
+
+                if decompressor:
+                    chunk = decompressor.decompress(chunk)
+                    started = self.__measure("decompress", started,
+                                             len(chunk))
+
+                chunk = decoder.decode(chunk)
+                self.__measure("decode", started, len(chunk))
+                if chunk:
+                    yield chunk
+
+            chunk = decoder.decode(decompressor.flush() if decompressor
+                                   else "", True)
+            if chunk:
+                yield chunk
+        finally:
+            body.close()
 
 
     def __getitem__(self, header):
@@ -305,11 +1315,117 @@ class Response(object):
         Gets the data found in the body of the response
         @return: dict
         '''
+        if not self.__decoded:
+            self.__decode(u"".join(self.__read_chunks()))
+            self.__report()
+
+        return self.__json
+
+
+    def __decode(self, data):
+        '''
+        Parses the JSON body of the response.
+        @param data:unicode Body
+        '''
+        started = time.time()
         try:
-            return simplejson.loads(self.__data)
+            self.__json = simplejson.loads(data) if data else None
+            self.__measure("decode", started)
         except:
             if greendizer.DEBUG:
-                print self.__data
+                print data
+
+        self.__decoded = True
+
+
+    def iter_data(self):
+        '''
+        Iterates over the items of the JSON array found in the body of the
+        response, decoding them one at a time as the body is read, instead
+        of parsing the whole body beforehand.
+        Once the iteration is over, the body is no longer available through
+        the data property.
+        @return: generator
+        '''
+        if self.__decoded:
+            for item in (self.__json if isinstance(self.__json, list) else []):
+                yield item
+
+            return
+
+        chunks = self.__read_chunks()
+        state = {"data": u"", "eof": False}
+
+        def read_more(index):
+            #Drops what was parsed and appends the next chunk to the buffer.
+            chunk = next(chunks, None)
+            if chunk is None:
+                state["eof"] = True
+                return index
+
+            state["data"] = state["data"][index:] + chunk
+            return 0
+
+        def skip_whitespace(index):
+            while True:
+                index = JSON_WHITESPACE.match(state["data"], index).end()
+                if index < len(state["data"]) or state["eof"]:
+                    return index
+
+                index = read_more(index)
+
+        index = skip_whitespace(0)
+        if state["data"][index:index + 1] != "[":
+            self.__decode(state["data"][index:] + u"".join(chunks))
+            self.__report()
+            for item in (self.__json if isinstance(self.__json, list) else []):
+                yield item
+
+            return
+
+        self.__decoded = True
+        decoder = simplejson.JSONDecoder()
+        try:
+            index = skip_whitespace(index + 1)
+            while state["data"][index] != "]":
+                started = time.time()
+                try:
+                    item, end = decoder.raw_decode(state["data"], index)
+                    self.__measure("decode", started)
+                except (ValueError):
+                    if state["eof"]:
+                        raise
+
+                    index = read_more(index)
+                    continue
+
+                if end >= len(state["data"]) and not state["eof"]:
+                    #The item might go on in the next chunk.
+                    index = read_more(index)
+                    continue
+
+                yield item
+
+                index = skip_whitespace(end)
+                if state["data"][index] == ",":
+                    index = skip_whitespace(index + 1)
+                elif state["data"][index] != "]":
+                    raise ValueError("Expecting , delimiter")
+
+            for chunk in chunks:
+                #Reads the end of the body to release the connection.
+                pass
+
+            self.__report()
+        except (ValueError, IndexError), e:
+            chunks.close()
+            if greendizer.DEBUG:
+                print state["data"]
+
+            if isinstance(e, IndexError):
+                raise ValueError("Unexpected end of the JSON array")
+
+            raise
 
 
 
@@ -472,7 +1588,7 @@ class ContentRange(object):
         if is_empty_or_none(raw):
             return
 
-        match = re.match(cls.REG_EXP, raw)
+        match = re.match(cls.REG_EXP, raw, re.VERBOSE)
         if not match or len(match.groupdict()) < 4:
             return
 
@@ -0,0 +1,244 @@
+import math
+import threading
+
+
+
+
+STATIC_SEGMENTS = ["sellers", "buyers", "me", "emails", "invoices", "reports",
+                   "threads", "messages", "company", "companies", "settings"]
+SPANS = ["dns", "connect", "tls", "ttfb", "download", "decompress", "decode",
+         "request"]
+
+
+
+
+def get_uri_template(uri):
+    '''
+    Returns the template of a URI, where resource IDs are replaced by {id}.
+    @param uri:str URI
+    @return: str
+    '''
+    path = uri.split("?")[0]
+    return "/".join([ segment if not segment or segment in STATIC_SEGMENTS
+                      else "{id}" for segment in path.split("/") ])
+
+
+
+
+class Span(object):
+    '''
+    Represents a timed stage of an API request.
+    '''
+    def __init__(self, name, duration, tags, size=None):
+        '''
+        Initializes a new instance of the Span class.
+        @param name:str Name of the stage (dns, connect, tls, ttfb, download,
+        decompress, decode, or request for the whole exchange).
+        @param duration:float Duration in seconds
+        @param tags:dict Tags of the request (method, uri, template, status)
+        @param size:int Number of bytes processed, if relevant.
+        '''
+        self.name = name
+        self.duration = duration
+        self.tags = tags
+        self.size = size
+
+
+    def __repr__(self):
+        '''
+        Returns a string representation of the span
+        @return: str
+        '''
+        return "<Span %s %s %s %.6fs>" % (self.name, self.tags.get("method"),
+                                          self.tags.get("template"),
+                                          self.duration)
+
+
+
+
+class Histogram(object):
+    '''
+    Represents the distribution of a series of durations, in buckets growing
+    by a constant ratio.
+    '''
+    def __init__(self, resolution=0.00001, ratio=1.25):
+        '''
+        Initializes a new instance of the Histogram class.
+        @param resolution:float Upper bound of the first bucket, in seconds.
+        @param ratio:float Ratio between the bounds of consecutive buckets.
+        '''
+        self.__resolution = resolution
+        self.__ratio = ratio
+        self.__buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.bytes = 0
+        self.min = None
+        self.max = None
+
+
+    def add(self, duration, size=None):
+        '''
+        Adds a duration to the histogram.
+        @param duration:float Duration in seconds
+        @param size:int Number of bytes processed
+        '''
+        index = 0
+        if duration > self.__resolution:
+            index = int(math.ceil(math.log(duration / self.__resolution,
+                                           self.__ratio)))
+
+        self.__buckets[index] = self.__buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += duration
+        self.bytes += size or 0
+        self.min = duration if self.min is None else min(self.min, duration)
+        self.max = duration if self.max is None else max(self.max, duration)
+
+
+    def merge(self, other):
+        '''
+        Adds the durations of another histogram with the same buckets.
+        @param other:Histogram
+        '''
+        for index, count in other.__buckets.items():
+            self.__buckets[index] = self.__buckets.get(index, 0) + count
+
+        self.count += other.count
+        self.total += other.total
+        self.bytes += other.bytes
+        for value in [other.min, other.max]:
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+
+
+    @property
+    def mean(self):
+        '''
+        Gets the mean duration.
+        @return: float
+        '''
+        return self.total / self.count if self.count else None
+
+
+    def percentile(self, percent):
+        '''
+        Gets an estimate of a percentile, as the upper bound of the bucket
+        in which it falls.
+        @param percent:float Percentile, between 0 and 100.
+        @return: float
+        '''
+        if not self.count:
+            return None
+
+        rank = max(1, int(math.ceil(self.count * percent / 100.0)))
+        seen = 0
+        for index in sorted(self.__buckets):
+            seen += self.__buckets[index]
+            if seen >= rank:
+                return min(self.max, self.__resolution *
+                           (self.__ratio ** index))
+
+
+
+
+class HistogramAggregator(object):
+    '''
+    Aggregates spans into histograms by span name, method, URI template and
+    status code. Add an instance to the hooks of a client to use it.
+    '''
+    def __init__(self, resolution=0.00001, ratio=1.25):
+        '''
+        Initializes a new instance of the HistogramAggregator class.
+        @param resolution:float Upper bound of the first bucket, in seconds.
+        @param ratio:float Ratio between the bounds of consecutive buckets.
+        '''
+        self.__resolution = resolution
+        self.__ratio = ratio
+        self.__histograms = {}
+        self.__lock = threading.Lock()
+
+
+    def __call__(self, span):
+        '''
+        Records a span.
+        @param span:Span
+        '''
+        key = (span.name, span.tags.get("method"), span.tags.get("template"),
+               span.tags.get("status"))
+        self.__lock.acquire()
+        try:
+            if key not in self.__histograms:
+                self.__histograms[key] = Histogram(self.__resolution,
+                                                   self.__ratio)
+
+            self.__histograms[key].add(span.duration, span.size)
+        finally:
+            self.__lock.release()
+
+
+    def get(self, name, method=None, template=None, status=None):
+        '''
+        Gets the histogram of a span, merging those matching the criteria
+        which are not None.
+        @param name:str Span name
+        @param method:str HTTP method
+        @param template:str URI template
+        @param status:int Status code
+        @return: Histogram
+        '''
+        merged = Histogram(self.__resolution, self.__ratio)
+        for (span, span_method, span_template, span_status), histogram in (
+                self.histograms.items()):
+            if (span == name and method in [None, span_method]
+                and template in [None, span_template]
+                and status in [None, span_status]):
+                merged.merge(histogram)
+
+        return merged
+
+
+    @property
+    def histograms(self):
+        '''
+        Gets the histograms by (name, method, template, status).
+        @return: dict
+        '''
+        self.__lock.acquire()
+        try:
+            return dict(self.__histograms)
+        finally:
+            self.__lock.release()
+
+
+    def summary(self, name="request"):
+        '''
+        Returns statistics of a span for every endpoint, slowest first.
+        @param name:str Span name
+        @return: list of dict
+        '''
+        rows = []
+        for (span, method, template, status), histogram in (
+                self.histograms.items()):
+            if span == name:
+                rows.append({"method": method, "template": template,
+                             "status": status, "count": histogram.count,
+                             "mean": histogram.mean,
+                             "p50": histogram.percentile(50),
+                             "p95": histogram.percentile(95),
+                             "p99": histogram.percentile(99),
+                             "max": histogram.max, "bytes": histogram.bytes})
+
+        return sorted(rows, key=lambda row: -row["mean"])
+
+
+    def clear(self):
+        '''
+        Removes all the histograms.
+        '''
+        self.__lock.acquire()
+        try:
+            self.__histograms = {}
+        finally:
+            self.__lock.release()
@@ -0,0 +1,161 @@
+import zlib
+import base64
+import hashlib
+import threading
+import simplejson
+from gzip import GzipFile
+from collections import deque
+from urlparse import urlparse
+from greendizer.http import Transport, Headers, CONNECTION_POOL
+
+
+
+
+MATCHED_HEADERS = ["range", "if-none-match", "if-match"]
+
+
+
+
+def get_request_key(method, url, body, headers):
+    '''
+    Returns the key identifying a request in a recording.
+    @param method:str HTTP method
+    @param url:str Absolute URL
+    @param body:str Encoded body
+    @param headers:dict HTTP headers
+    @return: str
+    '''
+    headers = Headers((headers or {}).items())
+    if body and headers.getheader("Content-Encoding", None):
+        #Compressed bodies are compared once decompressed.
+        body = zlib.decompress(body, 32 + zlib.MAX_WBITS)
+
+    if isinstance(body, unicode):
+        body = body.encode("utf-8")
+
+    parsed = urlparse(url)
+    parts = [headers.getheader("X-HTTP-Method-Override", method).upper(),
+             parsed.path + ("?" + parsed.query if parsed.query else "")]
+    parts.extend([ "%s=%s" % (name, headers.getheader(name))
+                   for name in MATCHED_HEADERS
+                   if headers.getheader(name, None) ])
+    if body:
+        parts.append(hashlib.sha1(body).hexdigest())
+
+    return " ".join(parts)
+
+
+
+
+class RecordingTransport(Transport):
+    '''
+    Represents a transport which records the requests sent through another
+    transport and their responses to a gzipped JSON lines file, to replay
+    them later with ReplayTransport.
+    '''
+    def __init__(self, filename, transport=CONNECTION_POOL):
+        '''
+        Initializes a new instance of the RecordingTransport class.
+        @param filename:str Path of the recording, appended to if it exists.
+        @param transport:Transport Transport sending the requests.
+        '''
+        self.__transport = transport
+        self.__file = GzipFile(filename, "ab")
+        self.__lock = threading.Lock()
+
+
+    def urlopen(self, method, url, body=None, headers=None, stream=False,
+                timings=None):
+        '''
+        Sends an HTTP request and records it along with its response.
+        Bodies are always read in full to be recorded.
+        @return: tuple (status, info, data)
+        '''
+        if callable(body):
+            body = "".join(body())
+
+        status, info, data = self.__transport.urlopen(method, url, body,
+                                                      headers, False, timings)
+        record = {"key": get_request_key(method, url, body, headers),
+                  "status": status,
+                  "headers": info.items(),
+                  "body": base64.b64encode(data or "")}
+
+        line = simplejson.dumps(record, separators=(',', ':')) + "\n"
+        self.__lock.acquire()
+        try:
+            self.__file.write(line)
+        finally:
+            self.__lock.release()
+
+        return status, info, data
+
+
+    def close(self):
+        '''
+        Closes the recording.
+        '''
+        self.__lock.acquire()
+        try:
+            self.__file.close()
+        finally:
+            self.__lock.release()
+
+
+
+
+class ReplayTransport(Transport):
+    '''
+    Represents a transport which serves the responses of a recording made
+    with RecordingTransport, without contacting the server.
+    When a request was recorded several times, its responses are served in
+    order, the last one being repeated.
+    '''
+    def __init__(self, filename):
+        '''
+        Initializes a new instance of the ReplayTransport class.
+        @param filename:str Path of the recording.
+        '''
+        self.__responses = {}
+        self.__lock = threading.Lock()
+        recording = GzipFile(filename, "rb")
+        try:
+            for line in recording:
+                record = simplejson.loads(line)
+                response = (record["status"],
+                            Headers([ (str(name), str(value)) for name, value
+                                      in record["headers"] ]),
+                            base64.b64decode(record["body"]))
+                self.__responses.setdefault(record["key"],
+                                            deque()).append(response)
+        finally:
+            recording.close()
+
+
+    def __len__(self):
+        '''
+        Returns the number of distinct requests recorded.
+        @return: int
+        '''
+        return len(self.__responses)
+
+
+    def urlopen(self, method, url, body=None, headers=None, stream=False,
+                timings=None):
+        '''
+        Returns the recorded response of an HTTP request.
+        @return: tuple (status, info, data)
+        '''
+        if callable(body):
+            body = "".join(body())
+
+        key = get_request_key(method, url, body, headers)
+        self.__lock.acquire()
+        try:
+            responses = self.__responses.get(key, None)
+            if not responses:
+                raise LookupError("No response recorded for %s" % key)
+
+            return responses.popleft() if len(responses) > 1 else responses[0]
+        finally:
+            self.__lock.release()
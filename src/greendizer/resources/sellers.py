@@ -2,7 +2,7 @@ import binascii
 import struct
 from datetime import timedelta
 from greendizer.base import Address, is_empty_or_none, extract_id_from_uri
-from greendizer.http import Request
+from greendizer.http import Request, ApiException, submit
 from greendizer.dal import Resource, Node
 from greendizer.resources import (User, EmailBase, InvoiceBase, ThreadBase,
                                   MessageBase, HistoryBase, InvoiceNodeBase,
@@ -12,6 +12,8 @@ from greendizer.resources import (User, EmailBase, InvoiceBase, ThreadBase,
 
 
 MAX_CONTENT_LENGTH = 512000 #500kb
+SIGNATURE_LENGTH = 4096 #Room left for the XMLdsig signature of an XMLi
+SIGNATURE_BATCH_SIZE = 32 #Number of XMLi signed at once by send_all
 
 
 
@@ -145,7 +147,142 @@ class InvoiceNode(InvoiceNodeBase):
         @param xmli:str Invoice XML representation.
         @return: InvoiceReport
         '''
-        xmli = unicode(xmli)
+        xmli = self.__sign(unicode(xmli), signature)
+        if self.__measure(xmli) > MAX_CONTENT_LENGTH:
+            raise ValueError("XMLi's size is limited to %skb."
+                             % (MAX_CONTENT_LENGTH / 1024))
+
+        return self.__post(xmli)
+
+
+    def send_async(self, xmli, signature=True, callback=None):
+        '''
+        Sends an invoice without blocking.
+        @param xmli:str Invoice XML representation.
+        @param callback:function Function called with the InvoiceReport.
+        @return: AsyncResult
+        '''
+        return submit(self.email.client, self.send, (xmli, signature),
+                      callback)
+
+
+    def send_all(self, invoices, signature=True):
+        '''
+        Sends any number of invoices, packing them in order into as few XMLi
+        as the limits on the number of invoices and on the size allow.
+        The XMLi are signed SIGNATURE_BATCH_SIZE at a time, in parallel, on
+        a pool of processes started once for the whole call.
+        If an XMLi cannot be sent, the exception raised has a reports
+        attribute listing the reports of the XMLi accepted before it.
+        @param invoices:iterable greendizer.xmli.Invoice instances.
+        @param signature:bool A value indicating whether to sign the XMLi
+        if keys were imported.
+        @return: list of InvoiceReport
+        '''
+        from greendizer.xmli import XMLiBuilder, MAX_LENGTH
+
+        head, tail = XMLiBuilder().to_string().split("<invoices/>")
+        head, tail = head + "<invoices>", "</invoices>" + tail
+
+        private_key, public_key = self.email.client.keys
+        limit = MAX_CONTENT_LENGTH - self.__measure(head + tail)
+        signer = None
+        if signature and private_key and public_key:
+            from greendizer import xmldsig
+            limit -= SIGNATURE_LENGTH
+            signer = xmldsig.Signer(private_key, public_key)
+
+        reports = []
+        batches, fragments, size = [], [], 0
+        try:
+            for invoice in invoices:
+                fragment = invoice.to_string()
+                length = self.__measure(fragment)
+                if len(fragments) and (len(fragments) >= MAX_LENGTH
+                                       or size + length > limit):
+                    batches.append(fragments)
+                    fragments, size = [], 0
+                    if len(batches) >= SIGNATURE_BATCH_SIZE:
+                        self.__send_batches(head, batches, tail, signature,
+                                            reports, signer)
+                        batches = []
+
+                fragments.append(fragment)
+                size += length
+
+            if len(fragments):
+                batches.append(fragments)
+
+            self.__send_batches(head, batches, tail, signature, reports,
+                                signer)
+        except Exception, e:
+            e.reports = reports
+            raise
+        finally:
+            if signer:
+                signer.close()
+
+        return reports
+
+
+    def __send_batches(self, head, batches, tail, signature, reports,
+                       signer=None):
+        '''
+        Signs a number of XMLi in parallel, then sends them in order.
+        @param head:str Beginning of the XMLi
+        @param batches:list Lists of serialized invoices, one per XMLi
+        @param tail:str End of the XMLi
+        @param signature:bool
+        @param reports:list List to which the reports are appended as soon
+        as the XMLi are accepted.
+        @param signer:greendizer.xmldsig.Signer Signer to use, if the XMLi
+        are to be signed.
+        '''
+        documents = [ head + "".join(fragments) + tail
+                      for fragments in batches ]
+        if signer:
+            documents = signer.sign_all(documents)
+
+        for fragments, xmli in zip(batches, documents):
+            reports.extend(self.__send_fragments(head, fragments, tail,
+                                                 signature, xmli))
+
+
+    def __send_fragments(self, head, fragments, tail, signature, xmli=None):
+        '''
+        Sends serialized invoices inside a single XMLi, or splits them
+        into two XMLi if the signed XMLi turns out to be too large.
+        @param head:str Beginning of the XMLi
+        @param fragments:list Serialized invoices
+        @param tail:str End of the XMLi
+        @param signature:bool
+        @param xmli:str XMLi already built and signed from the fragments.
+        @return: list of InvoiceReport
+        '''
+        if xmli is None:
+            xmli = self.__sign(head + "".join(fragments) + tail, signature)
+
+        if self.__measure(xmli) > MAX_CONTENT_LENGTH:
+            if len(fragments) == 1:
+                raise ValueError("XMLi's size is limited to %skb."
+                                 % (MAX_CONTENT_LENGTH / 1024))
+
+            middle = len(fragments) / 2
+            return (self.__send_fragments(head, fragments[:middle], tail,
+                                          signature)
+                    + self.__send_fragments(head, fragments[middle:], tail,
+                                            signature))
+
+        return [self.__post(xmli)]
+
+
+    def __sign(self, xmli, signature=True):
+        '''
+        Signs an XMLi if keys were imported.
+        @param xmli:unicode XMLi
+        @param signature:bool A value indicating whether to sign the XMLi.
+        @return: str
+        '''
         if is_empty_or_none(xmli):
             raise ValueError("Invalid XMLi")
 
@@ -157,25 +294,36 @@ class InvoiceNode(InvoiceNodeBase):
             from greendizer import xmldsig
             xmli = xmldsig.sign(xmli, private_key, public_key)
 
-        size = 0
-        try:
-            from os import sys
-            size = sys.getsizeof(xmli)
-        except AttributeError:
-            import base64 #2.5 and older...
-            size = len(base64.encodestring(xmli)) #1 ASCII = 1 byte
+        return xmli
+
+
+    def __measure(self, xmli):
+        '''
+        Returns the size of an XMLi once encoded.
+        @param xmli:str XMLi
+        @return: int
+        '''
+        if isinstance(xmli, unicode):
+            return len(xmli.encode("utf-8"))
+
+        return len(xmli)
 
-        if size > MAX_CONTENT_LENGTH:
-            raise ValueError("XMLi's size is limited to %skb."
-                             % MAX_CONTENT_LENGTH / 1024)
 
+    def __post(self, xmli):
+        '''
+        Posts an XMLi to the server.
+        @param xmli:str XMLi
+        @return: InvoiceReport
+        '''
         request = Request(self.email.client, method="POST", data=xmli,
                           uri=self._uri, content_type="application/xml")
 
         response = request.get_response()
-        if response.status_code == 202: #Accepted
-            return InvoiceReport(self.email,
-                                 extract_id_from_uri(response["Location"]))
+        if response.status_code != 202: #Accepted
+            raise ApiException(response)
+
+        return InvoiceReport(self.email,
+                             extract_id_from_uri(response["Location"]))
 
 
 
@@ -505,7 +653,8 @@ class BuyerNode(Node):
         @param seller:Seller Currently authenticated seller.
         '''
         self.__seller = seller
-        super(BuyerNode, self).__init__(seller, seller.uri + "buyers/", Buyer)
+        super(BuyerNode, self).__init__(seller.client, seller.uri + "buyers/",
+                                        Buyer)
 
 
     def get(self, identifier, default=None, **kwargs):
@@ -14,6 +14,7 @@ except ImportError:
 
 import hashlib
 import binascii
+import multiprocessing
 from StringIO import StringIO
 from Crypto.Hash import SHA
 from Crypto.Signature import PKCS1_v1_5
@@ -54,16 +55,22 @@ def c14n(xml):
 def sign(xml, private, public):
     '''
     Return xmldsig XML string from xml_string of XML.
+    The document is parsed once, canonicalized straight into the digest, and
+    the signature is inserted into the parsed tree.
     @param xml: str of bytestring xml to sign
     @param private: publicKey Private key
     @param public: publicKey Public key 
     @return str: signed XML byte string
     '''
-    xml = xml.encode('utf-8', 'xmlcharrefreplace')
-    signed_info_xml = _generate_signed_info(xml)
+    if isinstance(xml, unicode):
+        xml = xml.encode('utf-8', 'xmlcharrefreplace')
 
+    tree = etree.parse(StringIO(xml), etree.XMLParser(strip_cdata=False))
+    signed_info_xml = _generate_signed_info(tree)
+
+    #PTN_SIGNED_INFO_XML is already canonical: no need to apply c14n again.
     signer = PKCS1_v1_5.PKCS115_SigScheme(private)
-    signature_value = signer.sign(SHA.new(c14n(signed_info_xml)))
+    signature_value = signer.sign(SHA.new(signed_info_xml))
 
     signature_xml = PTN_SIGNATURE_XML % {
         'signed_info_xml': signed_info_xml,
@@ -71,8 +78,110 @@ def sign(xml, private, public):
         'key_info_xml': _generate_key_info_xml_rsa(public.key.n, public.key.e)
     }
 
-    position = xml.rfind('</')
-    return xml[0:position] + signature_xml + xml[position:]
+    tree.getroot().append(etree.fromstring(signature_xml))
+    return etree.tostring(tree, encoding='UTF-8',
+                          xml_declaration=xml.startswith('<?xml'))
+
+
+def sign_all(documents, private, public, processes=None):
+    '''
+    Signs several XML documents in parallel, on a pool of processes.
+    The keys are loaded once per process. Use a Signer to reuse the pool
+    for several lists of documents.
+    @param documents: list of str of bytestring xml to sign
+    @param private: publicKey Private key
+    @param public: publicKey Public key
+    @param processes: int Number of processes (defaults to the number of CPUs)
+    @return list: signed XML byte strings, in the same order as `documents`
+    '''
+    signer = Signer(private, public, processes)
+    try:
+        return signer.sign_all(documents)
+    finally:
+        signer.close()
+
+
+class Signer(object):
+    '''
+    Signs XML documents on a pool of processes, started on first use and
+    kept until the signer is closed, so that the keys are loaded once per
+    process. Can be used as a context manager.
+    '''
+    def __init__(self, private, public, processes=None):
+        '''
+        Initializes a new instance of the Signer class.
+        @param private: publicKey Private key
+        @param public: publicKey Public key
+        @param processes: int Number of processes (defaults to the number of
+        CPUs)
+        '''
+        self.__private = private
+        self.__public = public
+        self.__processes = processes
+        self.__pool = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def sign_all(self, documents):
+        '''
+        Signs several XML documents in parallel.
+        @param documents: list of str of bytestring xml to sign
+        @return list: signed XML byte strings, in the same order as
+        `documents`
+        '''
+        documents = list(documents)
+        if (not self.__pool
+            and (len(documents) < 2 or self.__processes == 1)):
+            return [ sign(xml, self.__private, self.__public)
+                     for xml in documents ]
+
+        if not self.__pool:
+            self.__pool = multiprocessing.Pool(self.__processes,
+                                               _load_worker_keys,
+                                               (self.__private.exportKey(),
+                                                self.__public.exportKey()))
+
+        return self.__pool.map(_sign_with_worker_keys, documents)
+
+
+    def close(self):
+        '''
+        Stops the processes of the pool.
+        '''
+        if self.__pool:
+            self.__pool.close()
+            self.__pool.join()
+            self.__pool = None
+
+
+_worker_keys = None
+
+
+def _load_worker_keys(private, public):
+    '''
+    Imports the keys used by the signing process.
+    @param private: str PEM encoded private key
+    @param public: str PEM encoded public key
+    '''
+    global _worker_keys
+    from Crypto.PublicKey import RSA
+    _worker_keys = (RSA.importKey(private), RSA.importKey(public))
+
+
+def _sign_with_worker_keys(xml):
+    '''
+    Signs an XML document with the keys of the signing process.
+    @param xml: str of bytestring xml to sign
+    @return str: signed XML byte string
+    '''
+    return sign(xml, *_worker_keys)
 
 
 def _generate_key_info_xml_rsa(modulus, exponent):
@@ -86,12 +195,31 @@ def _generate_key_info_xml_rsa(modulus, exponent):
                                    'exponent': b64e(exponent)}
 
 
-def _generate_signed_info(xml):
+def _generate_signed_info(tree):
+    '''
+    Applies c14n and returns <SignedInfo> for a parsed document.
+    @param tree: ElementTree Parsed document
+    @return: str of <SignedInfo> computed from `tree`
+    '''
+    digest = hashlib.sha1()
+    tree.write_c14n(_DigestWriter(digest), exclusive=False, with_comments=True)
+    return PTN_SIGNED_INFO_XML % {'digest_value': b64e(digest.digest()) }
+
+
+class _DigestWriter(object):
     '''
-    Applies c14n and returns <SignedInfo> for bytestring xml.
-    @param xml: str of bytestring
-    @return: str of <SignedInfo> computed from `xml`
+    File-like object feeding the data written to it into a hash.
     '''
-    return PTN_SIGNED_INFO_XML % {'digest_value': b64e(hashlib.sha1(c14n(xml))
-                                                       .digest()) }
+    def __init__(self, digest):
+        '''
+        @param digest: hashlib hash object
+        '''
+        self.__digest = digest
+
+
+    def write(self, data):
+        '''
+        @param data: str
+        '''
+        self.__digest.update(data)
 
@@ -1,8 +1,10 @@
 import re
+from weakref import ref, WeakKeyDictionary
 from xml.dom.minidom import Document
 from StringIO import StringIO
 from datetime import datetime, date
 from decimal import Decimal, ROUND_DOWN
+from xml.etree.cElementTree import iterparse
 from greendizer.base import is_empty_or_none, is_valid_email
 
 
@@ -90,7 +92,514 @@ def date_to_string(d):
 
 
 
-class XMLiElement(object):
+def string_to_date(value):
+    '''
+    Gets a date from its string representation. The time and the time zone,
+    if any, are ignored.
+    @param value:str String representation
+    @return: date
+    '''
+    return datetime.strptime(value.strip()[:10], "%Y-%m-%d").date()
+
+
+
+
+def value_to_string(value):
+    '''
+    Gets the string representation of a value inside a text node.
+    @param value:object Value
+    @return: str
+    '''
+    if isinstance(value, date):
+        value = date_to_string(value)
+
+    if isinstance(value, datetime):
+        value = datetime_to_string(value)
+
+    if isinstance(value, Decimal):
+        value = "0" if not value else str(value)
+
+    return str(value)
+
+
+
+
+def escape(data):
+    '''
+    Escapes the special characters of a text or attribute value.
+    @param data:str Text
+    @return: str
+    '''
+    return (data.replace("&", "&amp;").replace("<", "&lt;")
+            .replace("\"", "&quot;").replace(">", "&gt;"))
+
+
+
+
+def decimal_to_fixed(value, scale):
+    '''
+    Converts a decimal into an integer scaled by a power of ten.
+    @param value:Decimal Value
+    @param scale:int Number of decimal places kept
+    @return: long
+    '''
+    sign, digits, exponent = value.as_tuple()
+    fixed = long("".join(map(str, digits)) or 0) * 10 ** (scale + exponent)
+    return -fixed if sign else fixed
+
+
+
+
+def fixed_to_decimal(value, scale, exponent=None):
+    '''
+    Converts an integer scaled by a power of ten back into a decimal.
+    @param value:long Scaled value
+    @param scale:int Number of decimal places
+    @param exponent:int Exponent of the decimal, if it must differ from
+    -scale. The value must be representable with this exponent.
+    @return: Decimal
+    '''
+    if exponent is None:
+        exponent = -scale
+    elif scale + exponent >= 0:
+        value = value // 10 ** (scale + exponent)
+    else:
+        value = value * 10 ** -(scale + exponent)
+
+    return Decimal("%de%d" % (value, exponent))
+
+
+
+
+def fixed_exponent(value, scale):
+    '''
+    Gets the largest exponent with which a scaled integer can be represented
+    exactly as a decimal, or None if it is zero.
+    @param value:long Scaled value
+    @param scale:int Number of decimal places
+    @return: int
+    '''
+    if not value:
+        return None
+
+    exponent = -scale
+    while not value % 10:
+        value //= 10
+        exponent += 1
+
+    return exponent
+
+
+
+
+def compute_totals(lines):
+    '''
+    Computes the total discounts, taxes and amount of a list of lines in a
+    single pass, using exact fixed-point integer arithmetic instead of
+    decimals.
+    The exponents of the results are tracked along with their values, so
+    that they are equal to those of the Decimal computation.
+    @param lines:list List of lines
+    @return: tuple (total_discounts, total_taxes, total)
+    '''
+    treatments = {}
+    for line in lines:
+        for treatment in line.discounts + line.taxes:
+            treatments[id(treatment)] = treatment
+
+    def places(values):
+        exponents = [ v.as_tuple()[2] for v in values if v != INFINITY ]
+        return max([0] + [ -e for e in exponents ])
+
+    quantity_places = places([ line.quantity for line in lines ])
+    price_places = places([ line.unit_price for line in lines ])
+    rate_places = places([ t.rate for t in treatments.values() ])
+    bound_places = places([ bound for t in treatments.values() if t.interval
+                            for bound in (t.interval.lower,
+                                          t.interval.upper) ])
+
+    #Gross amounts and discount bases have gross_scale decimal places,
+    #discounts and tax bases base_scale, taxes and totals total_scale.
+    gross_scale = max(quantity_places + price_places, rate_places,
+                      bound_places)
+    base_scale = gross_scale + rate_places + 2
+    total_scale = base_scale + rate_places + 2
+
+    columns = {}
+    for key, t in treatments.items():
+        lower = upper = None
+        exponents = [t.rate.as_tuple()[2], None, None]
+        if t.interval:
+            lower = [ decimal_to_fixed(t.interval.lower, scale)
+                      for scale in (gross_scale, base_scale) ]
+            exponents[1] = t.interval.lower.as_tuple()[2]
+            if t.interval.upper != INFINITY:
+                upper = [ decimal_to_fixed(t.interval.upper, scale)
+                          for scale in (gross_scale, base_scale) ]
+                exponents[2] = t.interval.upper.as_tuple()[2]
+
+        columns[key] = (t.rate_type == RATE_TYPE_FIXED,
+                        decimal_to_fixed(t.rate, rate_places), lower, upper,
+                        exponents)
+
+    def compute(key, base, exponent, stage, scale):
+        #Mirrors Treatment.compute, with a result having
+        #scale + rate_places + 2 decimal places, and the exponent the
+        #Decimal result would have.
+        if base <= 0:
+            return 0, 0
+
+        fixed, rate, lower, upper, exponents = columns[key]
+        rate_exponent, lower_exponent, upper_exponent = exponents
+        if fixed:
+            if lower is None or base >= lower[stage]:
+                return rate * 10 ** (scale + 2), rate_exponent
+
+            return 0, 0
+
+        if lower is None:
+            value = base * rate
+            exponent += rate_exponent
+        elif base > lower[stage]:
+            if upper is not None and base > upper[stage]:
+                base, exponent = upper[stage], upper_exponent
+
+            value = (base - lower[stage]) * rate
+            exponent = min(exponent, lower_exponent) + rate_exponent
+        else:
+            return 0, 0
+
+        #An exact division keeps the ideal exponent when possible.
+        exact = fixed_exponent(value, scale + rate_places + 2)
+        return value, exponent if exact is None else min(exponent, exact)
+
+    shift = 10 ** (rate_places + 2)
+    total_discounts = total_taxes = total = 0
+    exponents = [0, 0, 0]
+    for line in lines:
+        gross = (decimal_to_fixed(line.quantity, quantity_places)
+                 * decimal_to_fixed(line.unit_price, price_places)
+                 * 10 ** (gross_scale - quantity_places - price_places))
+        gross_exponent = (line.quantity.as_tuple()[2]
+                          + line.unit_price.as_tuple()[2])
+        scaled_gross = gross * shift
+
+        discounts = discounts_exponent = 0
+        for d in line.discounts:
+            value, exponent = compute(id(d), gross, gross_exponent, 0,
+                                      gross_scale)
+            if value >= scaled_gross:
+                value, exponent = scaled_gross, gross_exponent
+
+            discounts += value
+            discounts_exponent = min(discounts_exponent, exponent)
+
+        if discounts >= scaled_gross:
+            discounts, discounts_exponent = scaled_gross, gross_exponent
+
+        base = scaled_gross - discounts
+        base_exponent = min(gross_exponent, discounts_exponent)
+        taxes = taxes_exponent = 0
+        for t in line.taxes:
+            value, exponent = compute(id(t), base, base_exponent, 1,
+                                      base_scale)
+            taxes += value
+            taxes_exponent = min(taxes_exponent, exponent)
+
+        total_discounts += discounts
+        total_taxes += taxes
+        total += (scaled_gross - discounts) * shift + taxes
+        exponents = [min(exponents[0], discounts_exponent),
+                     min(exponents[1], taxes_exponent),
+                     min(exponents[2], gross_exponent, discounts_exponent,
+                         taxes_exponent)]
+
+    return (fixed_to_decimal(total_discounts, base_scale, exponents[0]),
+            fixed_to_decimal(total_taxes, total_scale, exponents[1]),
+            fixed_to_decimal(total, total_scale, exponents[2]))
+
+
+
+
+class XMLiWriter(object):
+    '''
+    Writes XMLi markup straight to a file-like object, without building a
+    DOM tree.
+    The output is identical to the one of xml.dom.minidom.
+    '''
+    def __init__(self, stream, indent="", addindent="", newl=""):
+        '''
+        Initializes a new instance of the XMLiWriter class.
+        @param stream:file File-like object
+        @param indent:str Current indentation
+        @param addindent:str Indentation added to each level
+        @param newl:str Newline string
+        '''
+        self.__stream = stream
+        self.__indent = indent
+        self.__addindent = addindent
+        self.__newl = newl
+
+
+    def __open_tag(self, name, attributes):
+        '''
+        Writes an opening tag, without closing it.
+        @param name:str Tag name
+        @param attributes:dict Attributes
+        '''
+        write = self.__stream.write
+        write(self.__indent + "<" + name)
+        for key in sorted((attributes or {}).keys()):
+            write(" %s=\"" % key)
+            write(escape(attributes[key]))
+            write("\"")
+
+
+    def declaration(self, encoding=None):
+        '''
+        Writes the XML declaration.
+        @param encoding:str Encoding
+        '''
+        if encoding is None:
+            self.__stream.write('<?xml version="1.0" ?>' + self.__newl)
+        else:
+            self.__stream.write('<?xml version="1.0" encoding="%s"?>%s'
+                                % (encoding, self.__newl))
+
+
+    def start(self, name, attributes=None):
+        '''
+        Opens an element containing other elements.
+        @param name:str Tag name
+        @param attributes:dict Attributes
+        '''
+        self.__open_tag(name, attributes)
+        self.__stream.write(">" + self.__newl)
+        self.__indent += self.__addindent
+
+
+    def end(self, name):
+        '''
+        Closes the element opened last.
+        @param name:str Tag name
+        '''
+        self.__indent = self.__indent[:len(self.__indent)
+                                      - len(self.__addindent)]
+        self.__stream.write("%s</%s>%s" % (self.__indent, name, self.__newl))
+
+
+    def empty(self, name, attributes=None):
+        '''
+        Writes an element without any child.
+        @param name:str Tag name
+        @param attributes:dict Attributes
+        '''
+        self.__open_tag(name, attributes)
+        self.__stream.write("/>" + self.__newl)
+
+
+    def text(self, name, data, attributes=None):
+        '''
+        Writes an element containing a text node.
+        @param name:str Tag name
+        @param data:str Text
+        @param attributes:dict Attributes
+        '''
+        self.__open_tag(name, attributes)
+        self.__stream.write(">" + escape(data))
+        self.__stream.write("</%s>%s" % (name, self.__newl))
+
+
+    def cdata(self, name, data, attributes=None):
+        '''
+        Writes an element containing a CDATA section.
+        @param name:str Tag name
+        @param data:str Text
+        @param attributes:dict Attributes
+        '''
+        if data.find("]]>") >= 0:
+            raise ValueError("']]>' not allowed in a CDATA section")
+
+        self.__open_tag(name, attributes)
+        self.__stream.write(">" + self.__newl)
+        self.__stream.write("<![CDATA[%s]]>" % data)
+        self.__stream.write("%s</%s>%s" % (self.__indent, name, self.__newl))
+
+
+
+
+class Observable(object):
+    '''
+    Represents an object caching computed values, which must be invalidated
+    along with those of the objects containing it whenever it changes.
+    '''
+    __parents = None
+    __cache = None
+
+
+    def _attach(self, parent):
+        '''
+        Registers an object containing this one.
+        @param parent:Observable Parent object
+        '''
+        if self.__parents is None:
+            self.__parents = WeakKeyDictionary()
+
+        self.__parents[parent] = True
+
+
+    def _detach(self, parent):
+        '''
+        Unregisters an object which no longer contains this one.
+        @param parent:Observable Parent object
+        '''
+        if self.__parents is not None and parent in self.__parents:
+            del self.__parents[parent]
+
+
+    def _cached(self, name, compute):
+        '''
+        Returns a cached value, computing it if necessary.
+        @param name:str Name of the value
+        @param compute:function Function computing the value
+        @return: object
+        '''
+        if self.__cache is None:
+            self.__cache = {}
+
+        if name not in self.__cache:
+            self.__cache[name] = compute()
+
+        return self.__cache[name]
+
+
+    def _changed(self):
+        '''
+        Invalidates the values cached by this object and by the objects
+        containing it.
+        '''
+        self.__cache = None
+
+        for parent in (self.__parents or {}).keys():
+            parent._changed()
+
+
+
+
+class ElementList(list):
+    '''
+    Represents a list of XMLi elements notifying its owner of any change.
+    '''
+    def __init__(self, owner, items=[]):
+        '''
+        Initializes a new instance of the ElementList class.
+        @param owner:Observable Element owning the list
+        @param items:list Initial items
+        '''
+        super(ElementList, self).__init__(items)
+        self.__owner = ref(owner)
+        for item in items:
+            item._attach(owner)
+
+
+    def __changed(self, added=[], removed=[]):
+        '''
+        Updates the links between the owner and the items, and notifies
+        the owner.
+        @param added:list Items added to the list
+        @param removed:list Items removed from the list
+        '''
+        owner = self.__owner()
+        if owner is None:
+            return
+
+        for item in removed:
+            if item not in self:
+                item._detach(owner)
+
+        for item in added:
+            item._attach(owner)
+
+        owner._changed()
+
+
+    def append(self, item):
+        super(ElementList, self).append(item)
+        self.__changed([item])
+
+
+    def extend(self, items):
+        items = list(items)
+        super(ElementList, self).extend(items)
+        self.__changed(items)
+
+
+    def insert(self, index, item):
+        super(ElementList, self).insert(index, item)
+        self.__changed([item])
+
+
+    def remove(self, item):
+        super(ElementList, self).remove(item)
+        self.__changed(removed=[item])
+
+
+    def pop(self, *args):
+        item = super(ElementList, self).pop(*args)
+        self.__changed(removed=[item])
+        return item
+
+
+    def __setitem__(self, index, value):
+        removed = self[index]
+        super(ElementList, self).__setitem__(index, value)
+        if isinstance(index, slice):
+            self.__changed(list(value), removed)
+        else:
+            self.__changed([value], [removed])
+
+
+    def __delitem__(self, index):
+        removed = self[index]
+        super(ElementList, self).__delitem__(index)
+        self.__changed(removed=(removed if isinstance(index, slice)
+                                else [removed]))
+
+
+    def __setslice__(self, i, j, items):
+        self.__setitem__(slice(max(0, i), max(0, j)), items)
+
+
+    def __delslice__(self, i, j):
+        self.__delitem__(slice(max(0, i), max(0, j)))
+
+
+    def __iadd__(self, items):
+        self.extend(items)
+        return self
+
+
+    def __imul__(self, n):
+        added = list(self) * max(0, n - 1)
+        removed = list(self) if n <= 0 else []
+        super(ElementList, self).__imul__(n)
+        self.__changed(added, removed)
+        return self
+
+
+    def sort(self, *args, **kwargs):
+        super(ElementList, self).sort(*args, **kwargs)
+        self.__changed()
+
+
+    def reverse(self):
+        super(ElementList, self).reverse()
+        self.__changed()
+
+
+
+
+class XMLiElement(Observable):
     '''
     Represents an XMLi element.
     '''
@@ -106,24 +615,34 @@ class XMLiElement(object):
         if is_empty_or_none(value):
             return
 
-        if isinstance(value, date):
-            value = date_to_string(value)
-
-        if isinstance(value, datetime):
-            value = datetime_to_string(value)
-
-        if isinstance(value, Decimal):
-            value = "0" if not value else str(value)
-
         tag = root.ownerDocument.createElement(name)
         if cdata:
-            tag.appendChild(root.ownerDocument.createCDATASection(str(value)))
+            tag.appendChild(root.ownerDocument
+                            .createCDATASection(value_to_string(value)))
         else:
-            tag.appendChild(root.ownerDocument.createTextNode(str(value)))
+            tag.appendChild(root.ownerDocument
+                            .createTextNode(value_to_string(value)))
 
         return root.appendChild(tag)
 
 
+    def _write_text_node(self, writer, name, value, cdata=False):
+        '''
+        Writes a text node
+        @param writer:XMLiWriter Writer
+        @param name:str Tag name
+        @param value:object Text value
+        @param cdata:bool A value indicating whether to use CDATA or not.
+        '''
+        if is_empty_or_none(value):
+            return
+
+        if cdata:
+            writer.cdata(name, value_to_string(value))
+        else:
+            writer.text(name, value_to_string(value))
+
+
     def to_xml(self):
         '''
         Returns a DOM element containing the XML representation of the XMLi
@@ -133,14 +652,30 @@ class XMLiElement(object):
         raise NotImplementedError()
 
 
+    def _write(self, writer):
+        '''
+        Writes the XML representation of the XMLi element.
+        @param writer:XMLiWriter Writer
+        '''
+        raise NotImplementedError()
+
+
+    def write(self, stream, indent="", addindent="", newl=""):
+        '''
+        Writes the XML representation of the XMLi element to a file-like
+        object.
+        @param stream:file File-like object
+        '''
+        self._write(XMLiWriter(stream, indent, addindent, newl))
+
+
     def to_string(self, indent="", newl="", addindent=""):
         '''
         Returns a string representation of the XMLi element.
         @return: str
         '''
         buf = StringIO()
-        self.to_xml().writexml(buf, indent=indent, addindent=addindent,
-                               newl=newl)
+        self.write(buf, indent=indent, addindent=addindent, newl=newl)
         return buf.getvalue()
 
 
@@ -232,9 +767,36 @@ class ExtensibleXMLiElement(XMLiElement):
         return root
 
 
+    def _write(self, writer):
+        '''
+        Writes the custom tags of the ExtensibleXMLiElement.
+        @param writer:XMLiWriter Writer
+        '''
+        if not len(self.__custom_elements):
+            return
+
+        attributes = {}
+        tags = []
+        for uri, items in self.__custom_elements.items():
+            prefix, url = uri.split(":", 1)
+            attributes["xmlns:" + prefix] = url
+            for name, value in items.items():
+                tags.append((prefix + ":" + name, str(value)))
+
+        if not len(tags):
+            writer.empty("custom", attributes)
+            return
+
+        writer.start("custom", attributes)
+        for name, value in tags:
+            writer.cdata(name, value)
+
+        writer.end("custom")
+
 
 
-class Interval(object):
+
+class Interval(Observable):
     '''
     Represents an line treatment base interval
     '''
@@ -244,8 +806,30 @@ class Interval(object):
         @param lower:float Lower limit
         @param upper:flaot Upper limit
         '''
-        self.lower = Decimal(str(lower))
-        self.upper = Decimal(str(upper))
+        self.lower = lower
+        self.upper = upper
+
+
+    def __set_lower(self, value):
+        '''
+        Sets the lower limit
+        @param value:float
+        '''
+        self.__lower = Decimal(str(value))
+        self._changed()
+
+
+    def __set_upper(self, value):
+        '''
+        Sets the upper limit
+        @param value:float
+        '''
+        self.__upper = Decimal(str(value))
+        self._changed()
+
+
+    lower = property(lambda self: self.__lower, __set_lower)
+    upper = property(lambda self: self.__upper, __set_upper)
 
 
     @property
@@ -263,7 +847,7 @@ class Interval(object):
         @return: str
         '''
         return "[%s,%s]" % (self.lower,
-                            '' if self.upper != INFINITY else self.upper)
+                            '' if self.upper == INFINITY else self.upper)
 
 
     def __str__(self):
@@ -323,17 +907,23 @@ class Address(XMLiElement):
     country = property(lambda self: self.__country, __set_country)
 
 
-    def to_xml(self, name="address"):
+    def __validate(self):
         '''
-        Returns a DOM Element containing the XML representation of the
-        address.
-        @return:Element 
+        Checks that the required attributes are set.
         '''
         for n, v in { "address":self.street_address, "city": self.city,
                      "country": self.country}.items():
             if is_empty_or_none(v):
                 raise ValueError("'%s' attribute cannot be empty or None." % n)
 
+
+    def to_xml(self, name="address"):
+        '''
+        Returns a DOM Element containing the XML representation of the
+        address.
+        @return:Element 
+        '''
+        self.__validate()
         doc = Document()
         root = doc.createElement(name)
         self._create_text_node(root, "streetAddress", self.street_address, True)
@@ -344,6 +934,22 @@ class Address(XMLiElement):
         return root
 
 
+    def _write(self, writer, name="address"):
+        '''
+        Writes the XML representation of the address.
+        @param writer:XMLiWriter Writer
+        '''
+        self.__validate()
+        writer.start(name)
+        self._write_text_node(writer, "streetAddress", self.street_address,
+                              True)
+        self._write_text_node(writer, "city", self.city, True)
+        self._write_text_node(writer, "zipcode", self.zipcode)
+        self._write_text_node(writer, "state", self.state, True)
+        self._write_text_node(writer, "country", self.country)
+        writer.end(name)
+
+
 
 
 class Contact(XMLiElement):
@@ -380,11 +986,9 @@ class Contact(XMLiElement):
     email = property(lambda self: self.__email, __set_email)
 
 
-    def to_xml(self, tag_name="buyer"):
+    def __validate(self):
         '''
-        Returns an XMLi representation of the object.
-        @param tag_name:str Tag name
-        @return: Element
+        Checks that the required attributes are set.
         '''
         for n, v in { "name":self.name, "address": self.address }.items():
             if is_empty_or_none(v):
@@ -393,6 +997,14 @@ class Contact(XMLiElement):
         if self.__require_email and is_empty_or_none(self.email):
             raise ValueError("'email' attribute cannot be empty or None.")
 
+
+    def to_xml(self, tag_name="buyer"):
+        '''
+        Returns an XMLi representation of the object.
+        @param tag_name:str Tag name
+        @return: Element
+        '''
+        self.__validate()
         doc = Document()
         root = doc.createElement(tag_name)
         self._create_text_node(root, "name", self.name, True)
@@ -401,6 +1013,20 @@ class Contact(XMLiElement):
         return root
 
 
+    def _write(self, writer, tag_name="buyer"):
+        '''
+        Writes the XMLi representation of the contact.
+        @param writer:XMLiWriter Writer
+        @param tag_name:str Tag name
+        '''
+        self.__validate()
+        writer.start(tag_name)
+        self._write_text_node(writer, "name", self.name, True)
+        self._write_text_node(writer, "email", self.email)
+        self.address._write(writer)
+        writer.end(tag_name)
+
+
 
 
 class Shipping(XMLiElement):
@@ -416,21 +1042,38 @@ class Shipping(XMLiElement):
         self.recipient = recipient
 
 
-    def to_xml(self):
+    def __validate(self):
         '''
-        Returns an XMLi representation of the shipping details.
-        @return: Element
+        Checks that the required attributes are set.
         '''
         for n, v in { "recipient":self.recipient }.items():
             if is_empty_or_none(v):
                 raise ValueError("'%s' attribute cannot be empty or None." % n)
 
+
+    def to_xml(self):
+        '''
+        Returns an XMLi representation of the shipping details.
+        @return: Element
+        '''
+        self.__validate()
         doc = Document()
         root = doc.createElement("shipping")
         root.appendChild(self.recipient.to_xml("recipient"))
         return root
 
 
+    def _write(self, writer):
+        '''
+        Writes the XMLi representation of the shipping details.
+        @param writer:XMLiWriter Writer
+        '''
+        self.__validate()
+        writer.start("shipping")
+        self.recipient._write(writer, "recipient")
+        writer.end("shipping")
+
+
 
 
 class XMLiBuilder(object):
@@ -475,14 +1118,38 @@ class XMLiBuilder(object):
         return doc
 
 
+    def write(self, stream, indent="", addindent="", newl="",
+              encoding="UTF-8"):
+        '''
+        Writes the XMLi to a file-like object, one invoice at a time.
+        @param stream:file File-like object
+        @param encoding:str Encoding declared in the XML declaration
+        '''
+        if len(self.__invoices) > MAX_LENGTH:
+            raise Exception("Limited to %d invoices at a time." % MAX_LENGTH)
+
+        writer = XMLiWriter(stream, indent, addindent, newl)
+        writer.declaration(encoding)
+        writer.start("xmli", { "version": VERSION, "invoice-agent": AGENT })
+        if not len(self.__invoices):
+            writer.empty("invoices")
+        else:
+            writer.start("invoices")
+            for invoice in self.__invoices:
+                invoice._write(writer)
+
+            writer.end("invoices")
+
+        writer.end("xmli")
+
+
     def to_string(self, indent="", addindent="", newl=""):
         '''
         Returns a string representation of the XMLi element.
         @return: str
         '''
         buf = StringIO(u'')
-        self.to_xml().writexml(buf, indent=indent, addindent=addindent,
-                               newl=newl, encoding="UTF-8")
+        self.write(buf, indent=indent, addindent=addindent, newl=newl)
         serialized = buf.getvalue()
         buf.close()
         return serialized
@@ -505,6 +1172,247 @@ class XMLiBuilder(object):
 
 
 
+class XMLiReader(object):
+    '''
+    Reads the invoices of an XMLi document incrementally, one at a time.
+    The elements of an invoice are discarded as soon as they have been
+    read, so that memory usage does not grow with the size of the document.
+    '''
+    def __init__(self, source, skip_custom=False):
+        '''
+        Initializes a new instance of the XMLiReader class.
+        @param source:file File name or file-like object
+        @param skip_custom:bool A value indicating whether to ignore the
+        custom elements of the invoices, groups and lines.
+        '''
+        self.__source = source
+        self.__skip_custom = skip_custom
+
+
+    def __iter__(self):
+        '''
+        Iterates through the invoices of the document.
+        @return: generator of Invoice
+        '''
+        stack = []
+        declared = []
+        namespaces = []
+        prefixes = {}
+        customs = {}
+        groups = []
+        group = None
+        in_custom = False
+
+        for event, elem in iterparse(self.__source,
+                                     ("start-ns", "start", "end")):
+            if event == "start-ns":
+                declared.append(elem)
+                prefixes[elem[1]] = elem[0]
+                continue
+
+            if event == "start":
+                stack.append(elem)
+                if elem.tag == "custom":
+                    in_custom = True
+                    namespaces = declared
+                elif elem.tag == "group":
+                    group = Group()
+                elif elem.tag == "invoice":
+                    groups = []
+
+                declared = []
+                continue
+
+            stack.pop()
+            parent = stack[-1] if stack else None
+            if elem.tag == "custom":
+                in_custom = False
+                if not self.__skip_custom:
+                    owner = parent.tag if parent.tag != "body" else "invoice"
+                    customs[owner] = self.__read_custom(elem, namespaces,
+                                                        prefixes)
+
+                parent.remove(elem)
+
+            elif in_custom:
+                if self.__skip_custom:
+                    parent.remove(elem)
+
+            elif elem.tag == "line":
+                line = self.__read_line(elem)
+                self.__set_custom(line, customs.pop("line", {}))
+                group.lines.append(line)
+                parent.remove(elem)
+
+            elif elem.tag == "group":
+                group.name = (elem.findtext("name") or "").strip()
+                group.description = (elem.findtext("description")
+                                     or "").strip()
+                self.__set_custom(group, customs.pop("group", {}))
+                groups.append(group)
+                parent.remove(elem)
+
+            elif elem.tag == "invoice":
+                invoice = self.__read_invoice(elem)
+                invoice.groups.extend(groups)
+                self.__set_custom(invoice, customs.pop("invoice", {}))
+                parent.remove(elem)
+                groups = []
+                yield invoice
+
+
+    def __read_text(self, elem, name):
+        '''
+        Returns the text of a child element, or None if it is missing.
+        @param elem:Element Parent element
+        @param name:str Tag name
+        @return: str
+        '''
+        value = elem.findtext(name)
+        return value.strip() if value is not None else None
+
+
+    def __read_address(self, elem):
+        '''
+        Reads a postal address.
+        @param elem:Element address element
+        @return: Address
+        '''
+        return Address(street_address=self.__read_text(elem, "streetAddress"),
+                       city=self.__read_text(elem, "city"),
+                       zipcode=self.__read_text(elem, "zipcode"),
+                       state=self.__read_text(elem, "state"),
+                       country=self.__read_text(elem, "country"))
+
+
+    def __read_contact(self, elem, require_email=True):
+        '''
+        Reads a contact.
+        @param elem:Element buyer or recipient element
+        @param require_email:bool A value indicating whether the email
+        address of the contact is required.
+        @return: Contact
+        '''
+        return Contact(name=self.__read_text(elem, "name"),
+                       email=self.__read_text(elem, "email"),
+                       require_email=require_email,
+                       address=self.__read_address(elem.find("address")))
+
+
+    def __read_treatment(self, elem, cls):
+        '''
+        Reads a line treatment.
+        @param elem:Element tax or discount element
+        @param cls:type Treatment class
+        @return: Treatment
+        '''
+        interval = None
+        base = elem.get("base")
+        if base:
+            lower, upper = base.strip("[]").split(",")
+            interval = Interval(lower.strip() or 0, upper.strip() or INFINITY)
+
+        return cls(name=elem.get("name"), description=elem.get("description"),
+                   rate_type=elem.get("type"), rate=(elem.text or "").strip(),
+                   interval=interval)
+
+
+    def __read_line(self, elem):
+        '''
+        Reads an invoice line.
+        @param elem:Element line element
+        @return: Line
+        '''
+        attributes = { "name": self.__read_text(elem, "name"),
+                       "description": self.__read_text(elem, "description")
+                                      or "",
+                       "unit": self.__read_text(elem, "unit"),
+                       "quantity": Decimal(self.__read_text(elem, "quantity")
+                                           or 0),
+                       "unit_price": Decimal(self.__read_text(elem,
+                                                              "unitPrice")
+                                             or 0),
+                       "gin": self.__read_text(elem, "gin"),
+                       "gtin": self.__read_text(elem, "gtin"),
+                       "sscc": self.__read_text(elem, "sscc") }
+
+        value = self.__read_text(elem, "date")
+        if value:
+            attributes["date"] = string_to_date(value)
+
+        line = Line(**attributes)
+        for discount in elem.findall("discounts/discount"):
+            line.discounts.append(self.__read_treatment(discount, Discount))
+
+        for tax in elem.findall("taxes/tax"):
+            line.taxes.append(self.__read_treatment(tax, Tax))
+
+        return line
+
+
+    def __read_invoice(self, elem):
+        '''
+        Reads the header of an invoice.
+        @param elem:Element invoice element
+        @return: Invoice
+        '''
+        attributes = { "name": self.__read_text(elem, "name"),
+                       "description": self.__read_text(elem, "description"),
+                       "currency": self.__read_text(elem, "currency"),
+                       "status": self.__read_text(elem, "status"),
+                       "custom_id": self.__read_text(elem, "customId"),
+                       "terms": self.__read_text(elem, "terms"),
+                       "buyer": self.__read_contact(elem.find("buyer")),
+                       "shipping": None }
+
+        for name, tag in [("date", "date"), ("due_date", "dueDate")]:
+            value = self.__read_text(elem, tag)
+            if value:
+                attributes[name] = string_to_date(value)
+
+        recipient = elem.find("shipping/recipient")
+        if recipient is not None:
+            attributes["shipping"] = Shipping(self.__read_contact(recipient,
+                                                                  False))
+
+        return Invoice(**attributes)
+
+
+    def __read_custom(self, elem, namespaces, prefixes):
+        '''
+        Reads the custom elements of an extensible element.
+        @param elem:Element custom element
+        @param namespaces:list (prefix, uri) tuples declared by the element.
+        @param prefixes:dict Prefixes of all the namespaces declared so far,
+        by URI.
+        @return: dict
+        '''
+        custom = dict([ (prefix + ":" + uri, {})
+                        for prefix, uri in namespaces ])
+        for child in elem:
+            if not child.tag.startswith("{"):
+                continue
+
+            uri, name = child.tag[1:].split("}", 1)
+            namespace = prefixes[uri] + ":" + uri
+            custom.setdefault(namespace, {})[name] = (child.text
+                                                      or "").strip()
+
+        return custom
+
+
+    def __set_custom(self, element, custom):
+        '''
+        Sets the custom elements of an extensible element.
+        @param element:ExtensibleXMLiElement
+        @param custom:dict Custom elements by namespace
+        '''
+        for namespace, items in custom.items():
+            element[namespace].update(items)
+
+
+
+
 class Invoice(ExtensibleXMLiElement):
     '''
     Represents an Invoice object in the XMLi.
@@ -538,7 +1446,7 @@ class Invoice(ExtensibleXMLiElement):
         self.due_date = due_date or self.date
         self.custom_id = custom_id
         self.terms = terms
-        self.__groups = []
+        self.__groups = ElementList(self)
 
 
     @property
@@ -614,7 +1522,9 @@ class Invoice(ExtensibleXMLiElement):
         Gets the total amount of discounts of the invoice.
         @return: Decimal
         '''
-        return sum([group.total_discounts for group in self.__groups])
+        return self._cached("total_discounts", lambda:
+                            sum([group.total_discounts
+                                 for group in self.__groups]))
 
 
     @property
@@ -623,7 +1533,9 @@ class Invoice(ExtensibleXMLiElement):
         Gets the total amount of taxes of the invoice.
         @return: Decimal
         '''
-        return sum([group.total_taxes for group in self.__groups])
+        return self._cached("total_taxes", lambda:
+                            sum([group.total_taxes
+                                 for group in self.__groups]))
 
 
     @property
@@ -632,8 +1544,10 @@ class Invoice(ExtensibleXMLiElement):
         Gets the total of the invoice.
         @return: Decimal
         '''
-        return ((sum([group.total for group in self.__groups]) or Decimal(0))
-                .quantize(SIGNIFICANCE_EXPONENT, rounding=ROUND_DOWN))
+        return self._cached("total", lambda:
+                            (sum([group.total for group in self.__groups])
+                             or Decimal(0)).quantize(SIGNIFICANCE_EXPONENT,
+                                                     rounding=ROUND_DOWN))
 
 
     name = property(lambda self: self.__name, __set_name)
@@ -643,10 +1557,9 @@ class Invoice(ExtensibleXMLiElement):
     due_date = property(lambda self: self.__due_date, __set_due_date)
 
 
-    def to_xml(self):
+    def __validate(self):
         '''
-        Returns a DOM element containing the XML representation of the invoice
-        @return:Element
+        Checks that the required attributes are set.
         '''
         if not len(self.groups):
             raise Exception("An invoice must at least have one group.")
@@ -657,6 +1570,13 @@ class Invoice(ExtensibleXMLiElement):
             if is_empty_or_none(v):
                 raise ValueError("'%s' attribute cannot be empty or None." % n)
 
+
+    def to_xml(self):
+        '''
+        Returns a DOM element containing the XML representation of the invoice
+        @return:Element
+        '''
+        self.__validate()
         doc = Document()
         root = doc.createElement("invoice")
         root.appendChild(self.buyer.to_xml("buyer"))
@@ -687,22 +1607,61 @@ class Invoice(ExtensibleXMLiElement):
         return root
 
 
+    def _write(self, writer):
+        '''
+        Writes the XML representation of the invoice.
+        @param writer:XMLiWriter Writer
+        '''
+        self.__validate()
+        writer.start("invoice")
+        self.buyer._write(writer, "buyer")
+
+        if self.shipping:
+            self.shipping._write(writer)
+
+        self._write_text_node(writer, "name", self.name, True)
+        self._write_text_node(writer, "description", self.description, True)
+        self._write_text_node(writer, "currency", self.currency)
+        self._write_text_node(writer, "status", self.status)
+        self._write_text_node(writer, "date", self.date)
+        self._write_text_node(writer, "dueDate", self.due_date)
+        self._write_text_node(writer, "customId", self.custom_id, True)
+        self._write_text_node(writer, "terms", self.terms, True)
+        self._write_text_node(writer, "total", self.total)
+
+        writer.start("body")
+        writer.start("groups")
+        for group in self.__groups:
+            group._write(writer)
+
+        writer.end("groups")
+
+        #Adding custom elements
+        super(Invoice, self)._write(writer)
+        writer.end("body")
+        writer.end("invoice")
+
+
 
 
 class Group(ExtensibleXMLiElement):
     '''
     Represents a group of lines in the XMLi.
     '''
-    def __init__(self, name="", description=""):
+    def __init__(self, name="", description="", batch=False):
         '''
         Initializes a new instance of the Group class.
         @param name:str Group name.
         @param description:str Group description.
+        @param batch:bool A value indicating whether to compute the totals of
+        all the lines at once, with integer arithmetic (see compute_totals).
+        Recommended for groups with very large numbers of lines.
         '''
         super(Group, self).__init__()
         self.name = name
         self.description = description
-        self.__lines = []
+        self.batch = batch
+        self.__lines = ElementList(self)
 
 
     @property
@@ -720,7 +1679,12 @@ class Group(ExtensibleXMLiElement):
         Gets the total amount of discounts of the group.
         @return: Decimal
         '''
-        return sum([line.total_discounts for line in self.__lines])
+        if self.batch:
+            return self.__batch_totals[0]
+
+        return self._cached("total_discounts", lambda:
+                            sum([line.total_discounts
+                                 for line in self.__lines]))
 
 
     @property
@@ -729,7 +1693,11 @@ class Group(ExtensibleXMLiElement):
         Gets the total amount of taxes of the group.
         @return: Decimal
         '''
-        return sum([line.total_taxes for line in self.__lines])
+        if self.batch:
+            return self.__batch_totals[1]
+
+        return self._cached("total_taxes", lambda:
+                            sum([line.total_taxes for line in self.__lines]))
 
 
     @property
@@ -738,17 +1706,36 @@ class Group(ExtensibleXMLiElement):
         Gets the total of the group.
         @return: Decimal
         '''
-        return sum([line.total for line in self.__lines])
+        if self.batch:
+            return self.__batch_totals[2]
 
+        return self._cached("total", lambda:
+                            sum([line.total for line in self.__lines]))
 
-    def to_xml(self):
+
+    @property
+    def __batch_totals(self):
         '''
-        Returns a DOM representation of the group.
-        @return: Element
+        Gets the totals of the group computed in batch.
+        @return: tuple
+        '''
+        return self._cached("batch", lambda: compute_totals(self.__lines))
+
+
+    def __validate(self):
+        '''
+        Checks that the group is not empty.
         '''
         if not len(self.lines):
             raise Exception("A group must at least have one line.")
 
+
+    def to_xml(self):
+        '''
+        Returns a DOM representation of the group.
+        @return: Element
+        '''
+        self.__validate()
         doc = Document()
         root = doc.createElement("group")
         self._create_text_node(root, "name", self.name, True)
@@ -763,6 +1750,26 @@ class Group(ExtensibleXMLiElement):
         return root
 
 
+    def _write(self, writer):
+        '''
+        Writes the XML representation of the group.
+        @param writer:XMLiWriter Writer
+        '''
+        self.__validate()
+        writer.start("group")
+        self._write_text_node(writer, "name", self.name, True)
+        self._write_text_node(writer, "description", self.description, True)
+
+        writer.start("lines")
+        for line in self.__lines:
+            line._write(writer)
+
+        writer.end("lines")
+
+        super(Group, self)._write(writer)
+        writer.end("group")
+
+
 
 
 class Line(ExtensibleXMLiElement):
@@ -786,8 +1793,8 @@ class Line(ExtensibleXMLiElement):
         self.gin = gin
         self.gtin = gtin
         self.sscc = sscc
-        self.__taxes = []
-        self.__discounts = []
+        self.__taxes = ElementList(self)
+        self.__discounts = ElementList(self)
 
 
     @property
@@ -843,6 +1850,8 @@ class Line(ExtensibleXMLiElement):
         except ValueError:
             raise ValueError("Quantity must be a positive number")
 
+        self._changed()
+
 
     def __set_unit_price(self, value):
         '''
@@ -857,6 +1866,8 @@ class Line(ExtensibleXMLiElement):
         except ValueError:
             raise ValueError("Unit Price must be a positive number")
 
+        self._changed()
+
 
     @property
     def gross(self):
@@ -864,7 +1875,8 @@ class Line(ExtensibleXMLiElement):
         Gets the gross total
         @return: Decimal
         '''
-        return self.unit_price * self.quantity
+        return self._cached("gross", lambda:
+                            self.unit_price * self.quantity)
 
 
     @property
@@ -873,8 +1885,7 @@ class Line(ExtensibleXMLiElement):
         Gets the total amount of discounts applied to the current line.
         @return: Decimal
         '''
-        return min(self.gross, sum([ d.compute(self.gross)
-                                    for d in self.__discounts ]))
+        return self._cached("total_discounts", self.__compute_total_discounts)
 
 
     @property
@@ -883,8 +1894,7 @@ class Line(ExtensibleXMLiElement):
         Gets the total amount of taxes applied to the current line.
         @return: Decimal
         '''
-        base = self.gross - self.total_discounts
-        return sum([ t.compute(base) for t in self.__taxes ])
+        return self._cached("total_taxes", self.__compute_total_taxes)
 
 
     @property
@@ -893,7 +1903,26 @@ class Line(ExtensibleXMLiElement):
         Gets the total of the line.
         @return: Decimal
         '''
-        return self.gross + self.total_taxes - self.total_discounts
+        return self._cached("total", lambda: self.gross + self.total_taxes
+                                             - self.total_discounts)
+
+
+    def __compute_total_discounts(self):
+        '''
+        Computes the total amount of discounts applied to the current line.
+        @return: Decimal
+        '''
+        gross = self.gross
+        return min(gross, sum([ d.compute(gross) for d in self.__discounts ]))
+
+
+    def __compute_total_taxes(self):
+        '''
+        Computes the total amount of taxes applied to the current line.
+        @return: Decimal
+        '''
+        base = self.gross - self.total_discounts
+        return sum([ t.compute(base) for t in self.__taxes ])
 
 
     name = property(lambda self: self.__name, __set_name)
@@ -902,16 +1931,22 @@ class Line(ExtensibleXMLiElement):
     unit_price = property(lambda self: self.__unit_price, __set_unit_price)
 
 
-    def to_xml(self):
+    def __validate(self):
         '''
-        Returns a DOM representation of the line.
-        @return: Element
+        Checks that the required attributes are set.
         '''
         for n, v in { "name": self.name, "quantity": self.quantity,
                      "unit_price":self.unit_price }.items():
             if is_empty_or_none(v):
                 raise ValueError("'%s' attribute cannot be empty or None." % n)
 
+
+    def to_xml(self):
+        '''
+        Returns a DOM representation of the line.
+        @return: Element
+        '''
+        self.__validate()
         doc = Document()
         root = doc.createElement("line")
         self._create_text_node(root, "date", self.date)
@@ -941,6 +1976,41 @@ class Line(ExtensibleXMLiElement):
         return root
 
 
+    def _write(self, writer):
+        '''
+        Writes the XML representation of the line.
+        @param writer:XMLiWriter Writer
+        '''
+        self.__validate()
+        writer.start("line")
+        self._write_text_node(writer, "date", self.date)
+        self._write_text_node(writer, "name", self.name, True)
+        self._write_text_node(writer, "description", self.description, True)
+        self._write_text_node(writer, "quantity", self.quantity)
+        self._write_text_node(writer, "unitPrice", self.unit_price)
+        self._write_text_node(writer, "unit", self.unit)
+        self._write_text_node(writer, "gin", self.gin)
+        self._write_text_node(writer, "gtin", self.gtin)
+        self._write_text_node(writer, "sscc", self.sscc)
+
+        if len(self.__discounts):
+            writer.start("discounts")
+            for discount in self.__discounts:
+                discount._write(writer)
+
+            writer.end("discounts")
+
+        if len(self.__taxes):
+            writer.start("taxes")
+            for tax in self.__taxes:
+                tax._write(writer)
+
+            writer.end("taxes")
+
+        super(Line, self)._write(writer)
+        writer.end("line")
+
+
 
 
 class Treatment(XMLiElement):
@@ -961,7 +2031,8 @@ class Treatment(XMLiElement):
         self.description = description
         self.rate = rate
         self.rate_type = rate_type
-        self.__interval = interval
+        self.__interval = None
+        if interval: self.interval = interval
 
 
     def __set_interval(self, value):
@@ -969,10 +2040,17 @@ class Treatment(XMLiElement):
         Sets the treatment interval
         @param value:Interval
         '''
-        if not isinstance(self, Interval):
+        if value is not None and not isinstance(value, Interval):
             raise ValueError("'value' must be of type Interval")
 
+        if self.__interval:
+            self.__interval._detach(self)
+
         self.__interval = value
+        if value:
+            value._attach(self)
+
+        self._changed()
 
 
     def __set_name(self, value):
@@ -1006,6 +2084,7 @@ class Treatment(XMLiElement):
             raise ValueError("Invalid rate type.")
 
         self.__rate_type = value
+        self._changed()
 
 
     def __set_rate(self, value):
@@ -1018,6 +2097,8 @@ class Treatment(XMLiElement):
         except:
             raise ValueError("invalid rate value.")
 
+        self._changed()
+
 
     name = property(lambda self: self.__name, __set_name)
     description = property(lambda self: self.__description, __set_description)
@@ -1051,10 +2132,9 @@ class Treatment(XMLiElement):
         return ZERO
 
 
-    def to_xml(self, name):
+    def __validate(self):
         '''
-        Returns a DOM representation of the line treatment.
-        @return: Element
+        Checks that the required attributes are set.
         '''
         for n, v in { "rate_type": self.rate_type,
                      "rate": self.rate,
@@ -1063,6 +2143,13 @@ class Treatment(XMLiElement):
             if is_empty_or_none(v):
                 raise ValueError("'%s' attribute cannot be empty or None." % n)
 
+
+    def to_xml(self, name):
+        '''
+        Returns a DOM representation of the line treatment.
+        @return: Element
+        '''
+        self.__validate()
         doc = Document()
         root = doc.createElement(name)
         root.setAttribute("type", self.rate_type)
@@ -1073,6 +2160,21 @@ class Treatment(XMLiElement):
         return root
 
 
+    def _write(self, writer, name):
+        '''
+        Writes the XML representation of the line treatment.
+        @param writer:XMLiWriter Writer
+        @param name:str Tag name
+        '''
+        self.__validate()
+        attributes = { "type": self.rate_type, "name": self.name,
+                       "description": self.description }
+        if self.interval:
+            attributes["base"] = str(self.interval)
+
+        writer.text(name, str(self.rate), attributes)
+
+
 
 
 class Tax(Treatment):
@@ -1087,12 +2189,12 @@ class Tax(Treatment):
         return super(Tax, self).to_xml("tax")
 
 
-    def to_string(self, **kwargs):
+    def _write(self, writer):
         '''
-        Returns a string representation of the tax.
-        @return: str
+        Writes the XML representation of the tax.
+        @param writer:XMLiWriter Writer
         '''
-        return super(Tax, self).to_string("tax", **kwargs)
+        super(Tax, self)._write(writer, "tax")
 
 
 
@@ -1118,10 +2220,10 @@ class Discount(Treatment):
         return super(Discount, self).to_xml("discount")
 
 
-    def to_string(self, **kwargs):
+    def _write(self, writer):
         '''
-        Returns a string representation of the discount.
-        @return: str
+        Writes the XML representation of the discount.
+        @param writer:XMLiWriter Writer
         '''
-        return super(Discount, self).to_string("discount", **kwargs)
+        super(Discount, self)._write(writer, "discount")
 
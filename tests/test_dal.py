@@ -0,0 +1,41 @@
+import gc
+import unittest
+
+from greendizer import SellerClient
+from greendizer.fakeserver import FakeServer
+
+
+
+
+class UpdateAllTestCase(unittest.TestCase):
+    '''
+    Tests Node.update_all.
+    '''
+    def setUp(self):
+        self.server = FakeServer()
+        self.server.seed(invoices=450)
+        self.client = SellerClient(email="seller@example.com",
+                                   password="password")
+        self.client.transport = self.server
+        self.invoices = self.client.seller.emails["email0@example.com"].invoices
+
+
+    def test_flushes_unreferenced_resources(self):
+        for invoice in self.invoices.all.iterate():
+            invoice.read = True
+
+        invoice = None
+        gc.collect()
+
+        result = self.invoices.update_all()
+        self.assertEqual(len(result), 450)
+        self.assertTrue(result.ok)
+        self.assertEqual(len(self.client.identity_map.dirty), 0)
+        self.assertTrue(all([ invoice.read for invoice
+                              in self.invoices.all.iterate() ]))
+
+
+
+
+if __name__ == "__main__":
+    unittest.main()